@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+# ==== 設定 ====
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "backend/cache/checkpoints.sqlite3")
+
+
+class StageFailedError(RuntimeError):
+    """
+    ステージの結果にエラーが含まれていたことを表す例外。
+    """
+
+
+def contains_error_block(result) -> bool:
+    """
+    結果に、crawl4aiのLLM抽出が失敗したことを示すブロック（{"error": True, ...}）が含まれるかどうか。
+    """
+    if isinstance(result, dict):
+        return result.get("error") is True or any(
+            contains_error_block(value) for value in result.values()
+        )
+    if isinstance(result, list):
+        return any(contains_error_block(item) for item in result)
+    return False
+
+
+class StageCheckpoints:
+    """
+    URLごとの処理ステージの中間結果（Markdown・LLMの抽出結果・Web検索結果・口コミ）を保存するストア。
+
+    後続のステージが失敗しても、完了したステージの結果は (キー, ステージ名) で保存されているため、
+    再実行時は失敗したステージだけをやり直せる。ページの更新を検出したときや
+    URLの処理が完了したときにclearで削除する。
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                key TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (key, stage)
+            )
+            """
+        )
+
+    def get(self, key: str, stage: str):
+        """
+        保存済みの結果を返す。存在しない場合はNoneを返す。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM checkpoints WHERE key = ? AND stage = ?",
+                (key, stage),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, stage: str, result):
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (key, stage, payload, time.time()),
+            )
+
+    def clear(self, key: str):
+        """
+        キーに対応するすべてのステージの結果を削除する。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_checkpoints: Optional[StageCheckpoints] = None
+
+
+def get_checkpoints() -> StageCheckpoints:
+    """
+    プロセス全体で共有するStageCheckpointsを返す（初回呼び出し時に作成する）。
+    """
+    global _checkpoints
+    if _checkpoints is None:
+        _checkpoints = StageCheckpoints()
+    return _checkpoints
+
+
+async def run_stage(
+    key: Optional[str],
+    stage: str,
+    func: Callable[[], Awaitable],
+    checkpoints: StageCheckpoints = None,
+):
+    """
+    ステージの結果が保存済みならそれを返し、なければfuncを実行して結果を保存する。
+
+    Args:
+        key (str | None): 中間結果のキー（通常は処理対象のURL）。Noneの場合は保存しない。
+        stage (str): ステージ名。
+        func (Callable[[], Awaitable]): ステージの処理を行うコルーチン関数。
+        checkpoints (StageCheckpoints, optional): 使用するストア。省略時は共有ストア。
+
+    Returns:
+        funcの結果、または保存済みの結果。Noneの結果は保存しない。
+
+    Raises:
+        StageFailedError: funcの結果にエラーブロックが含まれていた場合（結果は保存しない）。
+    """
+    if key is not None:
+        checkpoints = checkpoints or get_checkpoints()
+        cached = checkpoints.get(key, stage)
+        # 以前に保存されたエラーを含む結果は使わずにやり直す
+        if cached is not None and not contains_error_block(cached):
+            print(f"♻️ 保存済みの中間結果を使用します: {stage} ({key})")
+            return cached
+    result = await func()
+    # LLM呼び出しに失敗した結果を保存すると、再実行のたびに同じ失敗が再生されるため、
+    # ステージの失敗として扱い、次回の実行でやり直す
+    if contains_error_block(result):
+        raise StageFailedError(f"ステージの結果にエラーが含まれています: {stage} ({key})")
+    if key is not None and result is not None:
+        checkpoints.put(key, stage, result)
+    return result
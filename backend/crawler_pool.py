@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig
+
+
+class CrawlerPool:
+    """
+    1つのAsyncWebCrawler（Playwright Chromium）を実行全体で共有し、
+    固定数のセッション（再利用されるページ）を呼び出し元に貸し出すプール。
+
+    使用例:
+        async with CrawlerPool(size=2) as crawler_pool:
+            result = await crawler_pool.arun(url, config)
+    """
+
+    def __init__(self, size: int = 2, browser_config: Optional[BrowserConfig] = None):
+        if size < 1:
+            raise ValueError("CrawlerPoolのsizeは1以上を指定してください。")
+        self.size = size
+        self._crawler = AsyncWebCrawler(config=browser_config)
+        self._sessions: asyncio.Queue = asyncio.Queue()
+        for i in range(size):
+            self._sessions.put_nowait(f"crawler_pool_session_{i}")
+
+    async def start(self) -> "CrawlerPool":
+        await self._crawler.start()
+        print(f"🌐 ブラウザを起動しました（ページ数: {self.size}）")
+        return self
+
+    async def close(self):
+        await self._crawler.close()
+        print("🌐 ブラウザを終了しました")
+
+    async def __aenter__(self) -> "CrawlerPool":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def arun(self, url: str, config: CrawlerRunConfig):
+        """
+        空いているセッションを1つ借りてクロールを実行する。
+        すべてのセッションが使用中の場合は、返却されるまで待機する。
+        """
+        session_id = await self._sessions.get()
+        try:
+            return await self._crawler.arun(
+                url=url, config=config.clone(session_id=session_id)
+            )
+        finally:
+            self._sessions.put_nowait(session_id)
+
+
+async def run_crawl(
+    url: str, config: CrawlerRunConfig, crawler_pool: Optional[CrawlerPool] = None
+):
+    """
+    プールが渡された場合は共有ブラウザで、渡されない場合は単発のクローラでURLを取得する。
+    """
+    if crawler_pool is not None:
+        return await crawler_pool.arun(url, config)
+    async with AsyncWebCrawler() as crawler:
+        return await crawler.arun(url=url, config=config)
@@ -1,104 +1,210 @@
-import ast
+import asyncio
+import os
+from typing import List, Tuple
 
+import httpx
 import pandas as pd
+from supabase import AsyncClient
 
-from .supabase_client import add_diving_courses, add_diving_shops, upload_shop_image
+from .supabase_client import (
+    add_diving_courses,
+    add_diving_shops,
+    create_async_client,
+    sync_diving_courses,
+    sync_diving_shops,
+    upload_shop_images,
+)
 
+try:
+    from instrumentation import span
+    from scripts.apply_course_description import explode_courses
+except ImportError:
+    # プロジェクトルートから `python -m backend.database...` として実行した場合
+    from ..instrumentation import span
+    from ..scripts.apply_course_description import explode_courses
 
-def save_to_db(merged_df: pd.DataFrame):
+# "diff": 変更のあった行だけを書き込む / "full": すべての行をupsertする
+DB_SYNC_MODE = os.getenv("DB_SYNC_MODE", "diff")
+# Trueの場合、ショップのページから消えたコースをDBからも削除する
+DB_DELETE_MISSING_COURSES = (
+    os.getenv("DB_DELETE_MISSING_COURSES", "false").lower() == "true"
+)
+
+
+def link_courses_to_shops(
+    courses_df: pd.DataFrame, db_shops_df: pd.DataFrame
+) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    コース表に、ショップ名をキーとした1回の結合でDB上のshop_idを付与する。
+
+    Args:
+        courses_df (pd.DataFrame): 'shop_name'列を含むコース表。
+        db_shops_df (pd.DataFrame): DBに保存されたショップの'id'列と'name'列。
+
+    Returns:
+        Tuple[pd.DataFrame, List[str]]: shop_idを付与したupsert用のコース表と、
+                                        DBのショップと名前が一致しなかったショップ名のリスト。
+    """
+    shop_ids = db_shops_df.rename(columns={"id": "shop_id", "name": "shop_name"})
+    shop_ids = shop_ids.drop_duplicates("shop_name")
+    linked_df = courses_df.merge(shop_ids, on="shop_name", how="left")
+    matched = linked_df["shop_id"].notna()
+    unmatched_names = linked_df.loc[~matched, "shop_name"].dropna().unique().tolist()
+    linked_df = linked_df[matched].drop(columns="shop_name")
+    return linked_df, unmatched_names
+
+
+def save_to_db(
+    merged_df: pd.DataFrame,
+    sync_mode: str = DB_SYNC_MODE,
+    delete_missing_courses: bool = DB_DELETE_MISSING_COURSES,
+    courses_df: pd.DataFrame = None,
+) -> Tuple[bool, List[str]]:
+    """
+    asave_to_dbの同期版（スクリプト用）。この呼び出しの間だけ非同期クライアントを作成する。
+    """
+
+    async def run() -> Tuple[bool, List[str]]:
+        async with create_async_client() as client:
+            return await asave_to_db(
+                client, merged_df, sync_mode, delete_missing_courses, courses_df
+            )
+
+    return asyncio.run(run())
+
+
+async def asave_to_db(
+    client: AsyncClient,
+    merged_df: pd.DataFrame,
+    sync_mode: str = DB_SYNC_MODE,
+    delete_missing_courses: bool = DB_DELETE_MISSING_COURSES,
+    courses_df: pd.DataFrame = None,
+    http_client: httpx.AsyncClient = None,
+) -> Tuple[bool, List[str]]:
     """
     マージされたダイビングショップのDataFrameをデータベースに保存する。
+    書き込みはすべて非同期クライアントで行うため、クロールなど他の処理と並行して実行できる。
 
     Args:
+        client (AsyncClient): create_async_clientで作成したクライアント。
         merged_df (pd.DataFrame): 保存するショップ情報とコース情報を含むDataFrame。
+        sync_mode (str, optional): "diff" の場合、既存の行と比較して変更のあった行だけを書き込む。
+                                   "full" の場合、すべての行をupsertする。
+        delete_missing_courses (bool, optional): diffモードで、今回のデータに含まれない
+                                                 対象ショップのコースを削除するかどうか。
+        courses_df (pd.DataFrame, optional): course_listを展開済みのコース表（'shop_name'列を含む）。
+                                             指定した場合は、course_listを展開し直さずにこれを使う。
+        http_client (httpx.AsyncClient, optional): 画像のダウンロードに使うクライアント。
+
+    Returns:
+        Tuple[bool, List[str]]: ショップ情報とコース情報の保存に成功したかどうかと、
+                                画像の処理に失敗した画像があるショップ名のリスト。
+                                画像は差分同期で変更のないショップでは処理されないため、
+                                呼び出し側はこれらのショップを未保存として扱い、再度保存すること。
     """
-    print("\n💾 データベースへの保存を開始します...")
-    try:
-        # 1. ショップ情報をDBに保存
-        # course_listはDBスキーマにないので除外
-        shops_to_save = merged_df.drop(
-            columns=["course_list"], errors="ignore"
-        ).to_dict("records")
-        print(f"  -> {len(shops_to_save)}件のショップ情報をupsertします。")
-        db_shops_result = add_diving_shops(shops_to_save)
-        print(f"  ✅ {len(db_shops_result)}件のショップ情報がDBに保存/更新されました。")
-
-        # 2. ショップ画像の処理
-        print("\n🖼️ ショップ画像の処理を開始します...")
-        for shop in db_shops_result:
-            shop_id = shop["id"]
-
-            # サムネイル画像 (image_url) の処理
-            thumbnail_url = shop.get("image_url")
-            if thumbnail_url and isinstance(thumbnail_url, str) and thumbnail_url.startswith(("http", "https")):
-                print(f"  -> サムネイル画像を処理中: {thumbnail_url}")
-                upload_shop_image(shop_id=shop_id, image_url=thumbnail_url, for_thumbnail=True)
-
-            # サイト内画像 (site_images) の処理
-            site_images = shop.get("site_images")
-            if site_images and isinstance(site_images, list):
-                print(f"  -> {len(site_images)}件のサイト内画像を処理中...")
-                for image_url in site_images:
-                    if image_url and isinstance(image_url, str) and image_url.startswith(("http", "https")):
-                        upload_shop_image(shop_id=shop_id, image_url=image_url, for_thumbnail=False)
-
-        # 3. コース情報にshop_idを紐付け
-        # DBから返された結果には最新のIDが含まれている
-        db_shops_df = pd.DataFrame(db_shops_result)[["id", "name"]]
-        db_shops_df.rename(columns={"id": "shop_id"}, inplace=True)
-
-        # 元のデータとDBから返ってきたデータをマージしてshop_idを取得
-        courses_df = merged_df[["name", "course_list"]].copy()
-        courses_df = pd.merge(courses_df, db_shops_df, on="name", how="left")
-
-        all_courses = []
-        for _, row in courses_df.iterrows():
-            if pd.notna(row["shop_id"]) and isinstance(row["course_list"], list):
-                for course in row["course_list"]:
-                    if isinstance(course, dict):
-                        course["shop_id"] = row["shop_id"]
-                        all_courses.append(course)
-
-        # 4. コース情報をDBに保存
-        if all_courses:
-            print(f"  -> {len(all_courses)}件のコース情報をupsertします。")
-            db_courses_result = add_diving_courses(all_courses)
-            print(
-                f"  ✅ {len(db_courses_result)}件のコース情報がDBに保存/更新されました。"
+    with span("save_to_db"):
+        print("\n💾 データベースへの保存を開始します...")
+        try:
+            # 1. ショップ情報をDBに保存
+            # course_listはDBスキーマにないので除外
+            shops_to_save = merged_df.drop(
+                columns=["course_list"], errors="ignore"
+            ).to_dict("records")
+            print(f"  -> {len(shops_to_save)}件のショップ情報を保存します（{sync_mode}）。")
+            if sync_mode == "diff":
+                with span("sync_diving_shops"):
+                    db_shops_result = await sync_diving_shops(client, shops_to_save)
+            else:
+                db_shops_result = await add_diving_shops(client, shops_to_save)
+            print(f"  ✅ {len(db_shops_result)}件のショップ情報がDBと同期されました。")
+
+            # 2. ショップ画像の処理（全ショップ分をまとめて並列処理する）
+            print("\n🖼️ ショップ画像の処理を開始します...")
+            images = []
+            for shop in db_shops_result:
+                shop_id = shop["id"]
+
+                # サムネイル画像 (image_url)
+                thumbnail_url = shop.get("image_url")
+                if (
+                    thumbnail_url
+                    and isinstance(thumbnail_url, str)
+                    and thumbnail_url.startswith(("http", "https"))
+                ):
+                    images.append({"shop_id": shop_id, "image_url": thumbnail_url, "for_thumbnail": True})
+
+                # サイト内画像 (site_images)
+                site_images = shop.get("site_images")
+                if site_images and isinstance(site_images, list):
+                    for image_url in site_images:
+                        if image_url and isinstance(image_url, str) and image_url.startswith(("http", "https")):
+                            images.append({"shop_id": shop_id, "image_url": image_url, "for_thumbnail": False})
+            _, failed_images = await upload_shop_images(
+                client, images, http_client=http_client
             )
-    except Exception as e:
-        print(f"❌ データベース保存中にエラーが発生しました: {e}")
+            failed_shop_ids = {image["shop_id"] for image in failed_images}
+            image_failed_names = sorted(
+                shop["name"] for shop in db_shops_result if shop["id"] in failed_shop_ids
+            )
+
+            # 3. コース情報にshop_idを紐付け
+            # DBから返された結果には最新のIDが含まれている
+            db_shops_df = pd.DataFrame(db_shops_result, columns=["id", "name"])
+
+            if courses_df is None:
+                courses_df = explode_courses(merged_df)
+            linked_df, unmatched_names = link_courses_to_shops(courses_df, db_shops_df)
+            if unmatched_names:
+                preview = "、".join(unmatched_names[:10])
+                more = f" ほか{len(unmatched_names) - 10}件" if len(unmatched_names) > 10 else ""
+                print(
+                    f"  ⚠️ DBのショップと名前が一致しないため、{len(unmatched_names)}件のショップの"
+                    f"コースを保存できませんでした: {preview}{more}"
+                )
+            all_courses = linked_df.to_dict("records")
+
+            # 4. コース情報をDBに保存
+            if all_courses:
+                print(f"  -> {len(all_courses)}件のコース情報を保存します（{sync_mode}）。")
+                if sync_mode == "diff":
+                    with span("sync_diving_courses"):
+                        db_courses_result = await sync_diving_courses(
+                            client, all_courses, delete_missing=delete_missing_courses
+                        )
+                else:
+                    db_courses_result = await add_diving_courses(client, all_courses)
+                print(
+                    f"  ✅ {len(db_courses_result)}件のコース情報がDBに保存/更新されました。"
+                )
+            return True, image_failed_names
+        except Exception as e:
+            print(f"❌ データベース保存中にエラーが発生しました: {e}")
+            return False, []
+
+
+def load_merged_dataset(file_path: str) -> pd.DataFrame:
+    """
+    JSON Lines形式の統合データを読み込む。
+    course_listやsite_imagesはJSONのリスト・オブジェクトのまま復元されるため、文字列からの変換は不要。
+    電話番号などの先頭の0が失われないよう、型の推測は行わない。
+    """
+    return pd.read_json(
+        file_path, lines=True, orient="records", dtype=False, convert_dates=False
+    )
 
 
-def load_and_save_from_csv(file_path: str):
+def load_and_save_from_jsonl(file_path: str):
     """
-    CSVファイルを読み込み、データベースに保存する。
+    JSON Lines形式の統合データを読み込み、データベースに保存する。
 
     Args:
-        file_path (str): 読み込むCSVファイルのパス。
+        file_path (str): 読み込むJSON Linesファイルのパス。
     """
     print(f"📄 {file_path} からデータを読み込んでいます...")
     try:
-        # CSVを読み込む際に、リストとして保存されている列を適切に変換する
-        converters = {
-            "course_list": lambda x: (
-                ast.literal_eval(x)
-                if isinstance(x, str)
-                and x.strip().startswith("[")
-                and x.strip().endswith("]")
-                else []
-            ),
-            "site_images": lambda x: (
-                ast.literal_eval(x)
-                if isinstance(x, str)
-                and x.strip().startswith("[")
-                and x.strip().endswith("]")
-                else []
-            ),
-        }
-        df = pd.read_csv(file_path, converters=converters)
+        df = load_merged_dataset(file_path)
         save_to_db(df)
     except FileNotFoundError:
         print(f"❌ ファイルが見つかりません: {file_path}")
     except Exception as e:
-        print(f"❌ CSVファイルの読み込みまたは処理中にエラーが発生しました: {e}")
+        print(f"❌ JSON Linesファイルの読み込みまたは処理中にエラーが発生しました: {e}")
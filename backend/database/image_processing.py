@@ -0,0 +1,64 @@
+import hashlib
+import io
+import os
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# ==== 設定 ====
+# 配信用の最大の横幅（これより小さい画像は拡大しない）
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1280"))
+THUMBNAIL_SIZE = (400, 300)
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+
+def hash_image(image_data: bytes) -> str:
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def _encode_webp(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def process_image(image_data: bytes, for_thumbnail: bool) -> Optional[dict]:
+    """
+    画像を配信用の1枚に縮小してWebPに再エンコードする。
+    imagesテーブルには1枚の画像につき1つのパスしか記録しないため、配信する1枚だけを生成する。
+
+    Args:
+        image_data (bytes): ダウンロードした元画像のバイト列。
+        for_thumbnail (bool): Trueの場合、一覧表示用のサムネイル（400x300）を生成する。
+                              Falseの場合、横幅がIMAGE_MAX_WIDTH以下になるよう縮小する。
+
+    Returns:
+        Optional[dict]: {"content_hash": 元画像のハッシュ, "name": 名前, "data": WebPのバイト列}。
+                        名前は "w1280" などの横幅、またはサムネイルの "thumbnail"。
+                        Pillowで読み込めない画像（SVGなど）の場合はNoneを返す。
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    # アニメーションは先頭フレームのみを使い、透過の有無に応じてモードを揃える
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    if for_thumbnail:
+        name = "thumbnail"
+        image = ImageOps.fit(image, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    else:
+        width = min(image.width, IMAGE_MAX_WIDTH)
+        name = f"w{width}"
+        if width < image.width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+    return {
+        "content_hash": hash_image(image_data),
+        "name": name,
+        "data": _encode_webp(image),
+    }
@@ -1,19 +1,19 @@
 # -*- coding: utf-8 -*-
 """
-CSVファイル→データベースへの保存処理を実行するスクリプト。
+統合データ（JSON Lines）→データベースへの保存処理を実行するスクリプト。
 プロジェクトのルートディレクトリから `python -m backend.database.save_from_csv` として実行してください。
 """
-from .database_handler import load_and_save_from_csv
+from .database_handler import load_and_save_from_jsonl
 
 
 def main():
     """
-    output/merged_df.csv を読み込んでDBに保存する
+    output/merged_shops.jsonl を読み込んでDBに保存する
     """
     # スクリプトがルートから実行されるため、パスはプロジェクトルートからの相対パス
-    csv_path = "output/merged_df.csv"
-    print(f"Attempting to load data from: {csv_path}")
-    load_and_save_from_csv(csv_path)
+    dataset_path = "output/merged_shops.jsonl"
+    print(f"Attempting to load data from: {dataset_path}")
+    load_and_save_from_jsonl(dataset_path)
 
 
 if __name__ == "__main__":
@@ -1,43 +1,323 @@
+import asyncio
+import hashlib
+import json
 import os
-import uuid
-from typing import List, Optional
+import random
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 
+import httpx
 import pandas as pd
-import requests
 from dotenv import load_dotenv
-from supabase import create_client
+from supabase import (
+    AsyncClient,
+    AsyncClientOptions,
+    Client,
+    acreate_client,
+    create_client,
+)
+
+from .image_processing import process_image
+
+try:
+    from instrumentation import annotate, span
+except ImportError:
+    # プロジェクトルートから `python -m backend.database...` として実行した場合
+    from ..instrumentation import annotate, span
 
 load_dotenv()
 supabase_url = os.getenv("SUPABASE_API_URL")
 supabase_key = os.getenv("SUPABASE_API_KEY")
 
-supabase = create_client(supabase_url, supabase_key)
+# 非同期クライアントのコネクションプール設定
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "10"))
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "30"))
+
+# 読み込み時の1ページあたりの行数と、IN条件1回あたりの値の数
+FETCH_PAGE_SIZE = int(os.getenv("FETCH_PAGE_SIZE", "1000"))
+FETCH_IN_CHUNK_SIZE = int(os.getenv("FETCH_IN_CHUNK_SIZE", "200"))
+
+# 画像のダウンロード・アップロードの同時実行数
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", "8"))
+# 一括upsertの1リクエストあたりの行数・同時リクエスト数・チャンクごとのリトライ回数
+UPSERT_CHUNK_SIZE = int(os.getenv("UPSERT_CHUNK_SIZE", "500"))
+UPSERT_MAX_CONCURRENCY = int(os.getenv("UPSERT_MAX_CONCURRENCY", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "3"))
+
+# diving_shops / diving_courses テーブルに存在するカラム
+DIVING_SHOP_COLUMNS = [
+    "id",
+    "name",
+    "description",
+    "location",
+    "prefecture",
+    "city",
+    "address",
+    "phone",
+    "email",
+    "website",
+    "image_url",
+    "site_images",
+    "rating",
+    "review_count",
+]
+DIVING_COURSE_COLUMNS = [
+    "shop_id",
+    "title",
+    "price",
+    "level",
+    "min_days",
+    "full_description",
+]
+
+
+class BulkUpsertError(RuntimeError):
+    """リトライしても保存できなかったチャンクがある場合に、bulk_upsert_rowsが送出する例外。"""
+
+
+_client: Optional[Client] = None
+
+
+def get_client() -> Client:
+    """
+    同期クライアントを返す（初回呼び出し時に作成する）。
+    """
+    global _client
+    if _client is None:
+        _client = create_client(supabase_url, supabase_key)
+    return _client
 
 
-def fetch_all(table_name: str) -> List[dict]:
-    response = supabase.table(table_name).select("*").execute()
-    return response.data
+@asynccontextmanager
+async def create_async_client(
+    transport: httpx.AsyncBaseTransport = None,
+) -> AsyncIterator[AsyncClient]:
+    """
+    HTTP/2のコネクションプールを持つ非同期クライアントを作成し、ブロックを抜けるときにプールを閉じる。
+
+    テーブル操作とStorageの操作で1つのhttpx.AsyncClientを共有するため、同時に多くの
+    リクエストを発行しても接続はSUPABASE_MAX_CONNECTIONS本までに抑えられる。
+    DBへの書き込みがイベントループを止めないため、クロールと並行して保存できる。
+
+    Args:
+        transport (httpx.AsyncBaseTransport, optional): 通信に使うトランスポート。
+                                                       ベンチマークなどでローカルの代替実装に接続する場合に指定する。
+    """
+    http_client = httpx.AsyncClient(
+        http2=transport is None,
+        timeout=SUPABASE_TIMEOUT_SECONDS,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_CONNECTIONS,
+        ),
+        transport=transport,
+    )
+    try:
+        yield await acreate_client(
+            supabase_url,
+            supabase_key,
+            options=AsyncClientOptions(httpx_client=http_client),
+        )
+    finally:
+        await http_client.aclose()
+
+
+def _apply_filters(query, filters: Optional[dict]):
+    """
+    filtersの値がリスト・タプル・集合ならin_、それ以外ならeqで絞り込む。
+    """
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            query = query.in_(column, list(value))
+        else:
+            query = query.eq(column, value)
+    return query
+
+
+def iter_rows(
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+    page_size: int = FETCH_PAGE_SIZE,
+    order_by: str = "id",
+) -> Iterator[List[dict]]:
+    """
+    テーブルの行を、キーセットページネーションでページごとに返すジェネレータ。
+
+    order_byのカラム（一意であること）で並べ、前のページの最後の値より大きい行を取得するため、
+    サーバー側の最大行数の制限を受けず、途中で行が追加・削除されても読み飛ばしや重複が起きない。
+    空のページが返った時点で終了する。
+
+    Args:
+        table_name (str): 読み込むテーブル名。
+        columns (List[str], optional): 取得するカラム。省略時は全カラム。
+                                       order_byのカラムは常に含まれる。
+        filters (dict, optional): {カラム名: 値} の絞り込み条件（値がリストの場合はIN）。
+        page_size (int, optional): 1リクエストあたりの行数。
+        order_by (str, optional): ページ送りに使う一意なカラム。
+
+    Yields:
+        List[dict]: 1ページ分の行のリスト。
+    """
+    last_value = None
+    while True:
+        query = _page_query(
+            get_client(), table_name, columns, filters, page_size, order_by, last_value
+        )
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        # PostgRESTのmax-rowsがpage_sizeより小さいと、途中のページでも件数が足りなくなるため、
+        # 空のページが返るまで読み進める
+        last_value = rows[-1][order_by]
+
+
+def _page_query(
+    client, table_name, columns, filters, page_size, order_by, last_value
+):
+    """
+    iter_rows / aiter_rows の1ページ分のクエリを作る（同期・非同期のどちらのクライアントでも使える）。
+    """
+    if columns:
+        columns = list(dict.fromkeys([order_by, *columns]))
+    select = ",".join(columns) if columns else "*"
+    query = _apply_filters(client.table(table_name).select(select), filters)
+    if last_value is not None:
+        query = query.gt(order_by, last_value)
+    return query.order(order_by).limit(page_size)
+
+
+async def aiter_rows(
+    client: AsyncClient,
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+    page_size: int = FETCH_PAGE_SIZE,
+    order_by: str = "id",
+):
+    """
+    iter_rowsの非同期版。ページごとの行のリストを返す非同期ジェネレータ。
+    """
+    last_value = None
+    while True:
+        query = _page_query(
+            client, table_name, columns, filters, page_size, order_by, last_value
+        )
+        rows = (await query.execute()).data or []
+        if not rows:
+            return
+        yield rows
+        last_value = rows[-1][order_by]
+
+
+def iter_frames(
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+    page_size: int = FETCH_PAGE_SIZE,
+    order_by: str = "id",
+    as_arrow: bool = False,
+):
+    """
+    iter_rowsのページを、pandasのDataFrame（as_arrow=Trueの場合はpyarrow.Table）として返す。
+    """
+    if as_arrow:
+        import pyarrow as pa
+
+    for rows in iter_rows(table_name, columns, filters, page_size, order_by):
+        yield pa.Table.from_pylist(rows) if as_arrow else pd.DataFrame(rows)
+
+
+def fetch_all(
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+) -> List[dict]:
+    """
+    条件に合うすべての行を返す（内部ではiter_rowsでページごとに取得する）。
+    """
+    return [
+        row for rows in iter_rows(table_name, columns, filters) for row in rows
+    ]
+
+
+def fetch_rows_in(
+    table_name: str,
+    column: str,
+    values: List,
+    columns: Optional[List[str]] = None,
+) -> List[dict]:
+    """
+    columnの値がvaluesのいずれかに一致する行を返す。
+    valuesが多い場合もURLが長くなりすぎないよう、FETCH_IN_CHUNK_SIZE件ずつに分けて取得する。
+    """
+    values = list(dict.fromkeys(values))
+    result = []
+    for i in range(0, len(values), FETCH_IN_CHUNK_SIZE):
+        chunk = values[i:i + FETCH_IN_CHUNK_SIZE]
+        result.extend(fetch_all(table_name, columns, {column: chunk}))
+    return result
+
+
+async def afetch_all(
+    client: AsyncClient,
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+) -> List[dict]:
+    """
+    fetch_allの非同期版。
+    """
+    return [
+        row
+        async for rows in aiter_rows(client, table_name, columns, filters)
+        for row in rows
+    ]
+
+
+async def afetch_rows_in(
+    client: AsyncClient,
+    table_name: str,
+    column: str,
+    values: List,
+    columns: Optional[List[str]] = None,
+) -> List[dict]:
+    """
+    fetch_rows_inの非同期版。分割したIN条件のクエリは並行して発行する。
+    """
+    values = list(dict.fromkeys(values))
+    pages = await asyncio.gather(
+        *(
+            afetch_all(
+                client, table_name, columns, {column: values[i:i + FETCH_IN_CHUNK_SIZE]}
+            )
+            for i in range(0, len(values), FETCH_IN_CHUNK_SIZE)
+        )
+    )
+    return [row for rows in pages for row in rows]
 
 
 def fetch_by_id(table_name: str, row_id: str) -> Optional[dict]:
     response = (
-        supabase.table(table_name).select("*").eq("id", row_id).maybe_single().execute()
+        get_client().table(table_name).select("*").eq("id", row_id).maybe_single().execute()
     )
     return response.data
 
 
 def insert_row(table_name: str, data: dict) -> dict:
-    response = supabase.table(table_name).insert(data).execute()
+    response = get_client().table(table_name).insert(data).execute()
     return response.data[0] if response.data else {}
 
 
 def update_row(table_name: str, row_id: str, data: dict) -> dict:
-    response = supabase.table(table_name).update(data).eq("id", row_id).execute()
+    response = get_client().table(table_name).update(data).eq("id", row_id).execute()
     return response.data[0] if response.data else {}
 
 
 def delete_row(table_name: str, row_id: str) -> dict:
-    response = supabase.table(table_name).delete().eq("id", row_id).execute()
+    response = get_client().table(table_name).delete().eq("id", row_id).execute()
     return response.data[0] if response.data else {}
 
 
@@ -49,173 +329,546 @@ def upsert_rows(table_name: str, data: List[dict], on_conflict: str) -> List[dic
     if not data:
         return []
     response = (
-        supabase.table(table_name).upsert(data, on_conflict=on_conflict).execute()
+        get_client().table(table_name).upsert(data, on_conflict=on_conflict).execute()
+    )
+    return response.data
+
+
+async def aupsert_rows(
+    client: AsyncClient, table_name: str, data: List[dict], on_conflict: str
+) -> List[dict]:
+    """
+    upsert_rowsの非同期版。イベントループを止めずにupsertする。
+    """
+    if not data:
+        return []
+    response = (
+        await client.table(table_name).upsert(data, on_conflict=on_conflict).execute()
     )
     return response.data
 
 
-def add_diving_shops(data: List[dict]) -> List[dict]:
+async def _upsert_chunk_with_retry(
+    client: AsyncClient,
+    semaphore: asyncio.Semaphore,
+    table_name: str,
+    chunk: List[dict],
+    on_conflict: str,
+    max_retries: int,
+) -> List[dict]:
+    """
+    1チャンクをupsertし、失敗した場合はジッター付き指数バックオフでそのチャンクだけをリトライする。
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                return await aupsert_rows(client, table_name, chunk, on_conflict)
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            wait = random.uniform(0, 2**attempt)
+            print(f"⏳ {table_name} へのupsertに失敗したため{wait:.1f}秒後にリトライします: {e}")
+            await asyncio.sleep(wait)
+    return []
+
+
+async def abulk_upsert_rows(
+    client: AsyncClient,
+    table_name: str,
+    data: List[dict],
+    on_conflict: str,
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+    max_concurrency: int = UPSERT_MAX_CONCURRENCY,
+    max_retries: int = UPSERT_MAX_RETRIES,
+) -> List[dict]:
+    """
+    大量の行をチャンクに分けて並列にupsertする。
+
+    各チャンクは1リクエスト（1トランザクション）として送られ、失敗したチャンクだけが
+    個別にリトライされる。リトライしても失敗したチャンクがある場合は、すべてのチャンクの
+    完了を待ってから例外を送出する（成功したチャンクは保存済みのまま残る）。
+
+    Args:
+        client (AsyncClient): create_async_clientで作成したクライアント。
+        table_name (str): upsert先のテーブル名。
+        data (List[dict]): upsertする行のリスト。
+        on_conflict (str): 重複判定に使うカラム（カンマ区切り）。
+        chunk_size (int, optional): 1リクエストあたりの行数。
+        max_concurrency (int, optional): 同時に送るリクエスト数。
+        max_retries (int, optional): チャンクごとのリトライ回数。
+
+    Returns:
+        List[dict]: 各チャンクのupsert結果を、入力順に結合したリスト。
+
+    Raises:
+        BulkUpsertError: リトライしても保存できなかったチャンクがある場合。
+    """
+    if not data:
+        return []
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with span(f"upsert:{table_name}", rows=len(data), items=len(chunks)):
+        chunk_results = await asyncio.gather(
+            *(
+                _upsert_chunk_with_retry(
+                    client, semaphore, table_name, chunk, on_conflict, max_retries
+                )
+                for chunk in chunks
+            ),
+            return_exceptions=True,
+        )
+    results = []
+    failed_rows = 0
+    for chunk, result in zip(chunks, chunk_results):
+        if isinstance(result, Exception):
+            failed_rows += len(chunk)
+            print(f"❌ {table_name} へのupsertに失敗しました（{len(chunk)}件）: {result}")
+        else:
+            results.extend(result or [])
+    if failed_rows:
+        raise BulkUpsertError(
+            f"{table_name}: {len(data)}件中、{failed_rows}件の行が保存されませんでした。"
+        )
+    return results
+
+
+def _is_missing(value) -> bool:
+    if isinstance(value, (list, dict, tuple, set)):
+        return False
+    return bool(pd.isna(value))
+
+
+def _to_int(value, default=None):
+    """
+    数値に変換できる値を整数に変換する。欠損値や変換できない値はdefaultを返す。
+    """
+    if _is_missing(value):
+        return default
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _project(row: dict, columns: List[str]) -> dict:
+    """
+    指定したカラムだけを残し、欠損値（NaN）をNone（JSONのnull）に置き換える。
+    """
+    return {
+        column: None if _is_missing(row[column]) else row[column]
+        for column in columns
+        if column in row
+    }
+
+
+def _present_columns(data: List[dict], columns: List[str]) -> List[str]:
+    present = set()
+    for row in data:
+        present.update(row)
+    return [column for column in columns if column in present]
+
+
+def prepare_diving_shops(data: List[dict]) -> List[dict]:
+    """
+    ショップ情報をdiving_shopsテーブルの形式（カラムの選択・欠損値の補完・型変換）に揃える。
+    """
+    # 欠損値を埋める値
+    default_values = {
+        "description": "",
+        "address": "",
+        "phone": "",
+        "email": "",
+        "website": "",
+        "image_url": "",
+        "location": "",
+        "prefecture": "",
+        "city": "",
+        "rating": 0,
+        "review_count": 0,
+    }
+    # いずれかの行に存在するカラムのみを対象にする
+    columns = _present_columns(data, DIVING_SHOP_COLUMNS)
+
+    data_to_upsert = []
+    for row in data:
+        shop = {column: row.get(column) for column in columns}
+        for column, default_value in default_values.items():
+            if column in shop and _is_missing(shop[column]):
+                shop[column] = default_value
+        if "review_count" in shop:
+            shop["review_count"] = _to_int(shop["review_count"], 0)
+        data_to_upsert.append(_project(shop, columns))
+    return data_to_upsert
+
+
+async def add_diving_shops(client: AsyncClient, data: List[dict]) -> List[dict]:
     """
     ショップ情報のリストをDBにupsertする。
     コース情報など、テーブルにないカラムは除外する。
     """
-    df = pd.DataFrame(data)
-    # DBスキーマに存在するカラムのみを選択
-    column_list = [
-        "id",
-        "name",
-        "description",
-        "location",
-        "prefecture",
-        "city",
-        "address",
-        "phone",
-        "email",
-        "website",
-        "image_url",
-        "site_images",
-        "rating",
-        "review_count",
-    ]
-    # dfに存在するカラムのみを対象にする
-    df_columns = [col for col in column_list if col in df.columns]
-    df = df[df_columns]
-
-    # 欠損値を適切に処理
-    df.fillna(
-        value={
-            "description": "",
-            "address": "",
-            "phone": "",
-            "email": "",
-            "website": "",
-            "image_url": "",
-            "location": "",
-            "prefecture": "",
-            "city": "",
-            "rating": 0,
-            "review_count": 0,
-        },
-        inplace=True,
-    )
-
-    # データ型を整形
-    df["review_count"] = (
-        pd.to_numeric(df["review_count"], errors="coerce").fillna(0).astype(int)
-    )
-
-    data_to_upsert = df.to_dict(orient="records")
+    data_to_upsert = prepare_diving_shops(data)
     # 'name' をコンフリクトのキーとしてupsertし、結果を返す
-    return upsert_rows("diving_shops", data_to_upsert, on_conflict="name")
+    return await abulk_upsert_rows(
+        client, "diving_shops", data_to_upsert, on_conflict="name"
+    )
 
 
-def add_diving_courses(data: List[dict]) -> List[dict]:
+def prepare_diving_courses(data: List[dict]) -> List[dict]:
     """
-    コース情報のリストをdiving_coursesテーブルにupsertする。
+    コース情報をdiving_coursesテーブルの形式（nameをtitleに変更・型変換・必須カラムのない行の除外）に揃える。
     """
     if not data:
         return []
-    df = pd.DataFrame(data)
-    # 必須カラムとデータ型を整形
-    df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0).astype(int)
-    df["level"] = df["level"].fillna("unknown").astype(str)
+    has_min_days = any("min_days" in row for row in data)
+    has_full_description = any("full_description" in row for row in data)
+
+    data_to_upsert = []
+    for row in data:
+        course = dict(row)
+        # 必須カラムとデータ型を整形
+        course["price"] = _to_int(course.get("price"), 0)
+        level = course.get("level")
+        course["level"] = "unknown" if _is_missing(level) else str(level)
+        # min_daysは整数（欠損値はNone）に変換
+        if has_min_days:
+            course["min_days"] = _to_int(course.get("min_days"))
+        # full_descriptionは文字列に変換し、欠損値を空文字で埋める
+        if has_full_description:
+            description = course.get("full_description")
+            course["full_description"] = (
+                "" if _is_missing(description) else str(description)
+            )
+
+        course["title"] = course.pop("name", None)
+        if _is_missing(course.get("shop_id")) or _is_missing(course["title"]):
+            continue
+        data_to_upsert.append(_project(course, DIVING_COURSE_COLUMNS))
+    return data_to_upsert
+
+
+async def add_diving_courses(client: AsyncClient, data: List[dict]) -> List[dict]:
+    """
+    コース情報のリストをdiving_coursesテーブルにupsertする。
+    """
+    data_to_upsert = prepare_diving_courses(data)
+    # shop_idとtitleの組み合わせでコンフリクトを判断
+    return await abulk_upsert_rows(
+        client, "diving_courses", data_to_upsert, on_conflict="shop_id,title"
+    )
 
-    # min_daysカラムが存在する場合、Nullable Integerに変換
-    if "min_days" in df.columns:
-        df["min_days"] = pd.to_numeric(df["min_days"], errors="coerce").astype("Int64")
 
-    # full_descriptionカラムが存在する場合、文字列に変換し、欠損値を空文字で埋める
-    if "full_description" in df.columns:
-        df["full_description"] = df["full_description"].fillna("").astype(str)
+def _normalize_for_hash(value):
+    # DBから返る値と比較するため、数値は型（intとfloat）の違いを無視する
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    return float(value)
 
-    df.rename(columns={"name": "title"}, inplace=True)
-    df.dropna(subset=["shop_id", "title"], inplace=True)
 
-    # DBスキーマに存在するカラムのみを対象とする
-    db_columns = ["shop_id", "title", "price", "level", "min_days", "full_description"]
-    df_columns = [col for col in db_columns if col in df.columns]
-    df_for_upsert = df[df_columns]
+def row_hash(row: dict, columns: List[str]) -> str:
+    """
+    指定したカラムの値から、行の内容を表すハッシュを計算する。
+    """
+    values = {column: _normalize_for_hash(row.get(column)) for column in columns}
+    payload = json.dumps(values, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # DataFrame内のNaNをNoneに置換してから辞書のリストに変換
-    # これにより、'min_days'などの欠損値がNaN(JSON非互換)からNone(JSONのnull)に変換される
-    data_to_upsert = df_for_upsert.where(pd.notna(df_for_upsert), None).to_dict(
-        orient="records"
-    )
 
-    # shop_idとtitleの組み合わせでコンフリクトを判断
-    return upsert_rows("diving_courses", data_to_upsert, on_conflict="shop_id,title")
+async def sync_diving_shops(client: AsyncClient, data: List[dict]) -> List[dict]:
+    """
+    ショップ情報を差分だけDBに反映する。
 
+    既存のショップを1回のクエリで取得して行ごとのハッシュを比較し、
+    新規または内容が変わったショップだけをupsertする。
 
-def upload_shop_image(
-    shop_id: str, image_url: str, for_thumbnail: bool, bucket_name: str = "shop-images"
-) -> Optional[str]:
+    Returns:
+        List[dict]: 対象の全ショップのDB上の行（idを含む）。変更のないショップは既存の行を返す。
     """
-    元の画像URLを元に、画像が未処理の場合のみStorageにアップロードし、imagesテーブルに記録する。
+    shops = prepare_diving_shops(data)
+    if not shops:
+        return []
+    names = [shop["name"] for shop in shops if shop.get("name")]
+    existing_rows = await afetch_rows_in(
+        client, "diving_shops", "name", names, DIVING_SHOP_COLUMNS
+    )
+    existing_by_name = {row["name"]: row for row in existing_rows}
+
+    changed_shops = []
+    unchanged_rows = []
+    for shop in shops:
+        existing = existing_by_name.get(shop.get("name"))
+        columns = [column for column in shop if column != "id"]
+        if existing is not None and row_hash(existing, columns) == row_hash(
+            shop, columns
+        ):
+            unchanged_rows.append(existing)
+        else:
+            changed_shops.append(shop)
+
+    print(
+        f"  -> ショップ: 新規・変更 {len(changed_shops)}件 / 変更なし {len(unchanged_rows)}件"
+    )
+    upserted_rows = await abulk_upsert_rows(
+        client, "diving_shops", changed_shops, on_conflict="name"
+    )
+    return upserted_rows + unchanged_rows
+
+
+async def sync_diving_courses(
+    client: AsyncClient, data: List[dict], delete_missing: bool = False
+) -> List[dict]:
+    """
+    コース情報を差分だけDBに反映する。
+
+    対象ショップの既存コースを1回のクエリで取得し、(shop_id, title)ごとにハッシュを比較して
+    新規または内容が変わったコースだけをupsertする。
 
     Args:
-        shop_id (str): 画像を紐付けるショップのUUID。
-        image_url (str): ダウンロード対象の画像のURL（スクレイピング元のURL）。
-        for_thumbnail (bool): この画像がサムネイル用かどうかのフラグ。
-        bucket_name (str, optional): アップロード先のSupabase Storageバケット名。
-                                 デフォルトは "shop_images"。
+        client (AsyncClient): create_async_clientで作成したクライアント。
+        data (List[dict]): shop_idを含むコース情報のリスト。
+        delete_missing (bool, optional): Trueの場合、対象ショップのコースのうち
+                                         今回のデータに含まれないものを削除する。
 
     Returns:
-        Optional[str]: 新しく画像がアップロードされた場合に、Supabase Storageの公開URLを返す。
-                       URLが無効、処理済み、またはエラーの場合はNoneを返す。
+        List[dict]: upsertされたコースの行のリスト。
     """
-    if not image_url or not isinstance(image_url, str):
-        return None
+    courses = prepare_diving_courses(data)
+    shop_ids = list({course["shop_id"] for course in courses})
+    if not shop_ids:
+        return []
+    existing_rows = await afetch_rows_in(
+        client, "diving_courses", "shop_id", shop_ids, DIVING_COURSE_COLUMNS
+    )
+    existing_by_key = {(row["shop_id"], row["title"]): row for row in existing_rows}
+
+    changed_courses = []
+    for course in courses:
+        existing = existing_by_key.get((course["shop_id"], course["title"]))
+        columns = list(course)
+        if existing is None or row_hash(existing, columns) != row_hash(
+            course, columns
+        ):
+            changed_courses.append(course)
+    print(
+        f"  -> コース: 新規・変更 {len(changed_courses)}件 / "
+        f"変更なし {len(courses) - len(changed_courses)}件"
+    )
+    upserted_rows = await abulk_upsert_rows(
+        client, "diving_courses", changed_courses, on_conflict="shop_id,title"
+    )
 
-    try:
-        # imagesテーブルで、同じショップIDと画像URLの組み合わせが既に存在するか確認
-        query = (
-            supabase.table("images")
-            .select("public_url")
-            .eq("shop_id", shop_id)
-            .eq("original_url", image_url)
-            .maybe_single()
-        )
-        response = query.execute()
+    if delete_missing:
+        current_keys = {(course["shop_id"], course["title"]) for course in courses}
+        removed_ids = [
+            row["id"] for key, row in existing_by_key.items() if key not in current_keys
+        ]
+        if removed_ids:
+            await client.table("diving_courses").delete().in_("id", removed_ids).execute()
+            print(f"  🗑️ 掲載がなくなったコースを{len(removed_ids)}件削除しました。")
+    return upserted_rows
 
-        if response is not None and response.data:
-            return None  # 既に処理済みのため何もしない
 
-        # 画像をダウンロード
-        response = requests.get(image_url, stream=True, timeout=10)
-        response.raise_for_status()
-        image_data = response.content
-        content_type = response.headers.get("Content-Type", "image/jpeg")
+async def fetch_existing_image_keys(client: AsyncClient, shop_ids: List[str]) -> set:
+    """
+    指定したショップの処理済み画像を1回のクエリで取得し、(shop_id, original_url)の集合を返す。
+    """
+    if not shop_ids:
+        return set()
+    rows = await afetch_rows_in(
+        client, "images", "shop_id", shop_ids, ["shop_id", "original_url"]
+    )
+    return {(row["shop_id"], row["original_url"]) for row in rows}
+
 
-        # 保存先のパスとファイル名を決定
+async def _upload_if_absent(
+    client: AsyncClient,
+    bucket_name: str,
+    storage_path: str,
+    data: bytes,
+    content_type: str,
+):
+    """
+    Storageにファイルをアップロードする。同じパスが既に存在する場合は何もしない。
+    """
+    with span("image_upload", bytes=len(data)):
+        try:
+            await client.storage.from_(bucket_name).upload(
+                path=storage_path,
+                file=data,
+                file_options={"content-type": content_type, "upsert": "false"},
+            )
+            print(f"  ✅ 画像を以下のパスにアップロードしました: {storage_path}")
+        except Exception as e:
+            # 内容のハッシュでパスを決めているため、既存なら同じ画像がアップロード済み
+            if "Duplicate" in str(e) or "409" in str(e) or "already exists" in str(e):
+                return
+            raise
+
+
+async def _store_image(
+    client: AsyncClient,
+    image_data: bytes,
+    content_type: str,
+    image_url: str,
+    for_thumbnail: bool,
+    bucket_name: str,
+) -> str:
+    """
+    画像を縮小・WebP化し、内容のハッシュから決まるパスにアップロードしてそのパスを返す。
+    Pillowで扱えない画像は元のバイト列のままアップロードする。
+    """
+    with span("image_process", bytes=len(image_data)):
+        processed = await asyncio.to_thread(process_image, image_data, for_thumbnail)
+    if processed is None:
+        content_hash = hashlib.sha256(image_data).hexdigest()
         file_extension = image_url.split(".")[-1].split("?")[0] or "jpg"
-        storage_path = f"{shop_id}/{uuid.uuid4()}.{file_extension}"
+        storage_path = (
+            f"images/{content_hash[:2]}/{content_hash}/original.{file_extension}"
+        )
+        await _upload_if_absent(
+            client, bucket_name, storage_path, image_data, content_type
+        )
+        return storage_path
+
+    content_hash = processed["content_hash"]
+    storage_path = f"images/{content_hash[:2]}/{content_hash}/{processed['name']}.webp"
+    await _upload_if_absent(
+        client, bucket_name, storage_path, processed["data"], "image/webp"
+    )
+    return storage_path
+
+
+async def _download_and_upload_image(
+    client: AsyncClient,
+    http_client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    image: dict,
+    bucket_name: str,
+    stored_images: dict,
+) -> Optional[dict]:
+    """
+    1枚の画像をダウンロード・変換してStorageにアップロードし、imagesテーブル用のレコードを返す。
+    同じ内容の画像（複数ショップで使われるロゴなど）は、実行中に1回だけアップロードする。
+    失敗した場合はNoneを返す。
+    """
+    shop_id, image_url = image["shop_id"], image["image_url"]
+    async with semaphore:
+        try:
+            with span("image_download"):
+                response = await http_client.get(image_url)
+                response.raise_for_status()
+                image_data = response.content
+                annotate(bytes=len(image_data))
+            content_type = response.headers.get("Content-Type", "image/jpeg")
+
+            key = (hashlib.sha256(image_data).hexdigest(), image["for_thumbnail"])
+            if key not in stored_images:
+                stored_images[key] = asyncio.ensure_future(
+                    _store_image(
+                        client,
+                        image_data,
+                        content_type,
+                        image_url,
+                        image["for_thumbnail"],
+                        bucket_name,
+                    )
+                )
+            storage_path = await stored_images[key]
+            public_url = await client.storage.from_(bucket_name).get_public_url(
+                storage_path
+            )
+        except httpx.HTTPError as e:
+            print(f"❌ 画像ダウンロードエラー (URL: {image_url}): {e}")
+            return None
+        except Exception as e:
+            print(f"❌ 画像処理エラー (URL: {image_url}): {e}")
+            return None
+
+    return {
+        "shop_id": shop_id,
+        "original_url": image_url,
+        "storage_path": storage_path,
+        "public_url": public_url,
+        "for_thumbnail": image["for_thumbnail"],
+    }
+
+
+async def upload_shop_images(
+    client: AsyncClient,
+    images: List[dict],
+    bucket_name: str = "shop-images",
+    max_concurrency: int = IMAGE_MAX_CONCURRENCY,
+    http_client: httpx.AsyncClient = None,
+) -> Tuple[List[dict], List[dict]]:
+    """
+    複数のショップ画像をまとめて処理する。
+
+    処理済みの (shop_id, original_url) を1回のクエリで確認し、未処理の画像だけを
+    接続を使い回すHTTPクライアントで並列にダウンロードして、ダウンロードできたものから
+    順に縮小・WebP化してStorageへアップロードする。アップロード先は画像内容のハッシュで
+    決まるため、同じ画像が重複して保存されることはない。
+    imagesテーブルへのレコードは最後に一括で挿入する。
+    処理に失敗した画像はimagesテーブルに記録されないため、次回の呼び出しで再度処理される。
+
+    Args:
+        client (AsyncClient): create_async_clientで作成したクライアント。
+        images (List[dict]): "shop_id", "image_url", "for_thumbnail" を持つ辞書のリスト。
+        bucket_name (str, optional): アップロード先のSupabase Storageバケット名。
+        max_concurrency (int, optional): ダウンロード・アップロードの同時実行数。
+        http_client (httpx.AsyncClient, optional): 画像のダウンロードに使うクライアント。
+                                                   省略時はこの呼び出しの間だけ作成する。
 
-        # Supabase Storageにアップロード
-        supabase.storage.from_(bucket_name).upload(
-            path=storage_path,
-            file=image_data,
-            file_options={"content-type": content_type},
+    Returns:
+        Tuple[List[dict], List[dict]]: imagesテーブルに挿入したレコードのリストと、
+                                       ダウンロードや変換・アップロードに失敗した画像のリスト。
+    """
+    # 同じショップ・同じURLの組み合わせは1回だけ処理する
+    unique_images = {}
+    for image in images:
+        image_url = image.get("image_url")
+        if not image_url or not isinstance(image_url, str):
+            continue
+        unique_images.setdefault((image["shop_id"], image_url), image)
+
+    existing_keys = await fetch_existing_image_keys(
+        client, list({shop_id for shop_id, _ in unique_images})
+    )
+    pending_images = [
+        image for key, image in unique_images.items() if key not in existing_keys
+    ]
+    print(
+        f"  -> {len(pending_images)}件の未処理画像をアップロードします"
+        f"（処理済み {len(unique_images) - len(pending_images)}件）。"
+    )
+    if not pending_images:
+        return [], []
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    stored_images = {}
+    if http_client is None:
+        http_context = httpx.AsyncClient(
+            timeout=10,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_concurrency),
+        )
+    else:
+        http_context = nullcontext(http_client)
+    async with http_context as http_client:
+        results = await asyncio.gather(
+            *(
+                _download_and_upload_image(
+                    client, http_client, semaphore, image, bucket_name, stored_images
+                )
+                for image in pending_images
+            )
         )
-        print(f"  ✅ 画像を以下のパスにアップロードしました: {storage_path}")
-
-        public_url = supabase.storage.from_(bucket_name).get_public_url(storage_path)
-
-        # imagesテーブルにレコードを挿入
-        image_record = {
-            "shop_id": shop_id,
-            "original_url": image_url,
-            "storage_path": storage_path,
-            "public_url": public_url,
-            "for_thumbnail": for_thumbnail,
-        }
-        supabase.table("images").insert(image_record).execute()
-
-        print(f"  ✅ imagesテーブルに記録しました: {public_url}")
-        return public_url
-
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 画像ダウンロードエラー (URL: {image_url}): {e}")
-        return None
-    except Exception as e:
-        print(f"❌ 画像処理エラー (URL: {image_url}): {e}")
-        return None
+
+    image_records = [record for record in results if record]
+    failed_images = [
+        image for image, record in zip(pending_images, results) if not record
+    ]
+    if image_records:
+        await client.table("images").insert(image_records).execute()
+        print(f"  ✅ imagesテーブルに{len(image_records)}件を記録しました。")
+    if failed_images:
+        print(f"  ⚠️ {len(failed_images)}件の画像を処理できませんでした。")
+    return image_records, failed_images
@@ -1,12 +1,23 @@
 import json
 import os
+import re
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Optional, Tuple
 
-import openai
 from dotenv import load_dotenv
+from instrumentation import annotate, span
+from llm_client import create_chat_completion, get_openai_client
 
 load_dotenv()
-api_key = os.environ.get("OPENAI_API_KEY")
-client = openai.OpenAI(api_key=api_key)
+client = get_openai_client()
+
+# 表記ゆれ→正規名の対応表（手動で編集可能なJSONファイル）
+COURSE_ALIAS_PATH = os.getenv("COURSE_ALIAS_PATH", "backend/course_aliases.json")
+# ローカル照合でこのスコア以上なら、LLMを呼ばずに一致とみなす
+COURSE_MATCH_THRESHOLD = float(os.getenv("COURSE_MATCH_THRESHOLD", "0.85"))
 
 # --- ダイビングコース/スペシャリティデータ（関数の外側） ---
 diving_course_data = {
@@ -45,6 +56,324 @@ diving_course_data = {
 }
 
 
+# --- ローカル照合用の設定 ---
+# 指導団体名などの接頭辞（正規化後の文字列に対して除去する）
+AGENCY_PREFIXES = ("padi", "naui", "ssi", "cmas", "bsac", "sdi", "tdi", "nasds")
+# コース名の後ろに付くことが多い語
+COURSE_SUFFIXES = ("スペシャリティコース", "スペシャルティコース", "コース", "講習", "ライセンス", "認定")
+# 区切り文字・括弧・空白など、照合時に無視する文字
+IGNORED_CHARS_PATTERN = re.compile(r"[\s・･·.,、。/()（）\[\]【】「」『』\"'&＆+]")
+# 長音記号の揺れ
+LONG_VOWEL_PATTERN = re.compile(r"[-‐‑‒–—―−ｰ~〜]")
+# ヴ行の揺れ（ヴァ→バ など）
+VU_FOLDING = {"ヴァ": "バ", "ヴィ": "ビ", "ヴェ": "ベ", "ヴォ": "ボ", "ヴ": "ブ"}
+
+# 正規名と表記が大きく異なる別名（手動で管理する）
+COURSE_SYNONYMS = {
+    "Scuba Diver": "スクーバ・ダイバー",
+    "Open Water Diver": "オープン・ウォーター・ダイバー",
+    "OWD": "オープン・ウォーター・ダイバー",
+    "Advanced Open Water Diver": "アドヴァンスド・オープン・ウォーター・ダイバー",
+    "AOW": "アドヴァンスド・オープン・ウォーター・ダイバー",
+    "AOWD": "アドヴァンスド・オープン・ウォーター・ダイバー",
+    "アドバンス": "アドヴァンスド・オープン・ウォーター・ダイバー",
+    "Rescue Diver": "レスキュー・ダイバー",
+    "Master Scuba Diver": "マスター・スクーバ・ダイバー",
+    "Divemaster": "ダイブマスター",
+    "Assistant Instructor": "アシスタント・インストラクター",
+    "Open Water Scuba Instructor": "オープン・ウォーター・スクーバ・インストラクター",
+    "OWSI": "オープン・ウォーター・スクーバ・インストラクター",
+    "Course Director": "コース・ディレクター",
+    "Peak Performance Buoyancy": "ピーク・パフォーマンス・ボイヤンシー (中性浮力)",
+    "PPB": "ピーク・パフォーマンス・ボイヤンシー (中性浮力)",
+    "中性浮力": "ピーク・パフォーマンス・ボイヤンシー (中性浮力)",
+    "Enriched Air Diver": "エンリッチド・エア・ダイバー",
+    "ナイトロックス": "エンリッチド・エア・ダイバー",
+    "エンリッチド・エア・ナイトロックス": "エンリッチド・エア・ダイバー",
+    "EANx": "エンリッチド・エア・ダイバー",
+    "Deep Diver": "ディープ・ダイバー",
+    "Underwater Navigator": "水中ナビゲーター",
+    "Night Diver": "ナイト・ダイバー",
+    "Drift Diver": "ドリフト・ダイバー",
+    "Boat Diver": "ボート・ダイバー",
+    "Search and Recovery Diver": "サーチ＆リカバリー・ダイバー",
+    "Digital Underwater Photographer": "デジタル水中フォトグラファー",
+    "水中写真": "デジタル水中フォトグラファー",
+    "Fish Identification": "魚の見分け方",
+    "フィッシュ・アイデンティフィケーション": "魚の見分け方",
+    "Wreck Diver": "レック・ダイバー (沈船)",
+    "Dry Suit Diver": "ドライスーツ・ダイバー",
+    "Altitude Diver": "高所ダイバー",
+    "Ice Diver": "アイス・ダイバー (氷)",
+    "Cavern Diver": "キャバーン・ダイバー (洞窟)",
+    "Rebreather Diver": "リブリーザー・ダイバー",
+    "Self-Reliant Diver": "セルフ・リライアント・ダイバー",
+}
+
+
+def _hiragana_to_katakana(text: str) -> str:
+    return "".join(
+        chr(ord(c) + 0x60) if "ぁ" <= c <= "ゖ" else c for c in text
+    )
+
+
+def normalize_course_name(text: str) -> str:
+    """
+    照合用にコース名を正規化する。
+
+    NFKC正規化（全角英数・半角カナの統一）、小文字化、ひらがな→カタカナ、
+    ヴ行・長音記号の揺れの統一、区切り文字と空白の除去、
+    指導団体名の接頭辞とコース名の接尾語の除去を行う。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _hiragana_to_katakana(text)
+    for before, after in VU_FOLDING.items():
+        text = text.replace(before, after)
+    text = LONG_VOWEL_PATTERN.sub("ー", text)
+    text = IGNORED_CHARS_PATTERN.sub("", text)
+    for prefix in AGENCY_PREFIXES:
+        if text.startswith(prefix) and len(text) > len(prefix):
+            text = text[len(prefix):]
+            break
+    for suffix in COURSE_SUFFIXES:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            text = text[: -len(suffix)]
+            break
+    return text
+
+
+def _bigrams(text: str) -> set:
+    if len(text) < 2:
+        return {text}
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _similarity(a: str, b: str) -> float:
+    """
+    文字bigramのDice係数と編集距離ベースの類似度の大きい方を返す。
+    """
+    a_bigrams, b_bigrams = _bigrams(a), _bigrams(b)
+    dice = 2 * len(a_bigrams & b_bigrams) / (len(a_bigrams) + len(b_bigrams))
+    return max(dice, SequenceMatcher(None, a, b).ratio())
+
+
+@lru_cache(maxsize=8)
+def _build_match_index(course_names: Tuple[str, ...]) -> dict:
+    """
+    正規名と別名を正規化した文字列から、正規名を引ける辞書を作る。
+    """
+    index = {normalize_course_name(name): name for name in course_names}
+    for synonym, canonical in COURSE_SYNONYMS.items():
+        if canonical in course_names:
+            index.setdefault(normalize_course_name(synonym), canonical)
+    return index
+
+
+def _extra_affix_length(normalized: str, key: str) -> int:
+    """
+    入力文字列のうち、照合先と一致しない先頭・末尾の部分の長さ（大きい方）を返す。
+    「ジュニア」のような余分な語が付いた入力を検出するために使う。
+    """
+    blocks = [
+        block
+        for block in SequenceMatcher(None, normalized, key).get_matching_blocks()
+        if block.size
+    ]
+    if not blocks:
+        return len(normalized)
+    leading = blocks[0].a
+    trailing = len(normalized) - (blocks[-1].a + blocks[-1].size)
+    return max(leading, trailing)
+
+
+# 語幹を作るときにコース名の末尾から取り除く語（「ナイト・ダイバー」→「ナイト」）
+MENTION_STEM_SUFFIXES = ("ダイバー", "diver")
+# 正規名の補足（「(沈船)」など）。ページ上では省略されることが多い
+PARENTHESES_PATTERN = re.compile(r"\s*[（(][^）)]*[）)]")
+
+
+def _is_mention_key(key: str, is_stem: bool) -> bool:
+    # 短すぎる英字の表記は無関係な単語（"price"の"ice"など）に一致しやすいため対象外とする
+    if key.isascii():
+        return len(key) >= (4 if is_stem else 3)
+    return len(key) >= 2
+
+
+@lru_cache(maxsize=8)
+def _build_mention_index(course_names: Tuple[str, ...]) -> dict:
+    """
+    ページ中の言及を探すための、正規化した表記・語幹から正規名を引ける辞書を作る。
+    「ナイトダイビング」「ドライスーツ」のような書き方にも一致するよう、
+    正規名と別名から「ダイバー」を除いた語幹も登録する。
+    """
+    keys = list(_build_match_index(course_names).items())
+    keys += [
+        (normalize_course_name(PARENTHESES_PATTERN.sub("", name)), name)
+        for name in course_names
+    ]
+    index = {}
+    for key, canonical in keys:
+        if _is_mention_key(key, is_stem=False):
+            index.setdefault(key, canonical)
+        for suffix in MENTION_STEM_SUFFIXES:
+            stem = key[: -len(suffix)]
+            if key.endswith(suffix) and _is_mention_key(stem, is_stem=True):
+                index.setdefault(stem, canonical)
+    return index
+
+
+def find_course_mentions(text: str, course_name_list) -> set:
+    """
+    テキスト中に表記（別名・語幹を含む）が現れる正規のコース名を、LLMを使わずに探す。
+    ページから抽出対象の領域を選ぶためのもので、一致は広めに取る。
+
+    Args:
+        text (str): 検索対象のテキスト（ページの1行など）。
+        course_name_list (list): 正規のコース/スペシャリティ名のリスト。
+
+    Returns:
+        set: 見つかった正規名の集合。
+
+    Examples:
+        >>> names = ["オープン・ウォーター・ダイバー", "ナイト・ダイバー", "ボート・ダイバー",
+        ...          "ドライスーツ・ダイバー", "ディープ・ダイバー", "レック・ダイバー (沈船)"]
+        >>> sorted(find_course_mentions("ナイトダイビング", names))
+        ['ナイト・ダイバー']
+        >>> sorted(find_course_mentions("ドライスーツ・ディープ・レック", names))
+        ['ディープ・ダイバー', 'ドライスーツ・ダイバー', 'レック・ダイバー (沈船)']
+        >>> sorted(find_course_mentions("ボートダイビング", names))
+        ['ボート・ダイバー']
+        >>> sorted(find_course_mentions("ジュニアオープンウォーター", names))
+        ['オープン・ウォーター・ダイバー']
+        >>> sorted(find_course_mentions("オープンウォーター講習", names))
+        ['オープン・ウォーター・ダイバー']
+        >>> find_course_mentions("料金表", names)
+        set()
+    """
+    index = _build_mention_index(tuple(course_name_list))
+    normalized = normalize_course_name(text)
+    return {canonical for key, canonical in index.items() if key in normalized}
+
+
+def match_course_name(
+    input_string: str, course_name_list
+) -> Tuple[Optional[str], float]:
+    """
+    LLMを使わずに、入力文字列に最も近い正規のコース名を探す。
+
+    Args:
+        input_string (str): 照合対象の文字列。
+        course_name_list (list): 正規のコース/スペシャリティ名のリスト。
+
+    Returns:
+        tuple: (最も近い正規名, スコア)。スコアは0〜1で、1は正規化後の完全一致。
+               候補がない場合は (None, 0.0) を返す。
+    """
+    index = _build_match_index(tuple(course_name_list))
+    normalized = normalize_course_name(input_string)
+    if not normalized or not index:
+        return None, 0.0
+    if normalized in index:
+        return index[normalized], 1.0
+
+    scores, best_keys = {}, {}
+    for key, canonical in index.items():
+        score = _similarity(normalized, key)
+        if score > scores.get(canonical, 0.0):
+            scores[canonical] = score
+            best_keys[canonical] = key
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best_name, best_score = ranked[0]
+    # 上位2件のスコアが拮抗している場合は判断をLLMに委ねる
+    if len(ranked) > 1 and best_score - ranked[1][1] < 0.05:
+        return best_name, min(best_score, COURSE_MATCH_THRESHOLD - 0.01)
+    # 正規名にない語が前後に付いている場合（「ジュニア・オープン・ウォーター・ダイバー」など）は
+    # 別のコースの可能性があるため、判断をLLMに委ねる
+    if _extra_affix_length(normalized, best_keys[best_name]) >= 2:
+        return best_name, min(best_score, COURSE_MATCH_THRESHOLD - 0.01)
+    return best_name, best_score
+
+
+class CourseAliasTable:
+    """
+    入力文字列から正規のコース名への対応表をJSONファイルで永続化する。
+
+    LLMの回答で自動的に追記されるほか、ファイルを直接編集して対応を修正・追加できる。
+    """
+
+    def __init__(self, path: str = COURSE_ALIAS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._aliases = json.load(f)
+        except FileNotFoundError:
+            self._aliases = {}
+
+    def get(self, input_string: str) -> Optional[str]:
+        return self._aliases.get(input_string)
+
+    def set(self, input_string: str, corrected_text: str):
+        self.update({input_string: corrected_text})
+
+    def update(self, corrections: dict):
+        """
+        複数の対応をまとめて追加し、変更があればファイルを1回だけ書き換える。
+        """
+        with self._lock:
+            changed = {
+                key: value
+                for key, value in corrections.items()
+                if self._aliases.get(key) != value
+            }
+            if not changed:
+                return
+            self._aliases.update(changed)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    self._aliases, f, indent=4, ensure_ascii=False, sort_keys=True
+                )
+            os.replace(tmp_path, self.path)
+
+
+_alias_table: Optional[CourseAliasTable] = None
+_alias_table_lock = threading.Lock()
+
+
+def get_alias_table() -> CourseAliasTable:
+    """
+    プロセス全体で共有する対応表を返す（初回呼び出し時にファイルから読み込む）。
+    asyncio.to_threadのワーカーから同時に呼ばれても、作成されるのは1つだけになる。
+    """
+    global _alias_table
+    if _alias_table is None:
+        with _alias_table_lock:
+            if _alias_table is None:
+                _alias_table = CourseAliasTable()
+    return _alias_table
+
+
+def resolve_course_name_locally(input_string, course_name_list) -> Optional[str]:
+    """
+    完全一致・対応表・ローカル照合の順に、APIを呼ばずに正規名を解決する。
+    解決できない場合はNoneを返す。
+    """
+    if input_string in course_name_list:
+        return input_string
+
+    cached_text = get_alias_table().get(input_string)
+    if cached_text is not None:
+        return cached_text
+
+    matched_name, score = match_course_name(input_string, course_name_list)
+    if matched_name is not None and score >= COURSE_MATCH_THRESHOLD:
+        return matched_name
+    return None
+
+
+@span("correct_diving_course_spelling")
 def correct_diving_course_spelling(input_string, llm_client, course_name_list):
     """
     ダイビングのコースやスペシャリティの文字列の表記ゆれを修正します。
@@ -57,10 +386,17 @@ def correct_diving_course_spelling(input_string, llm_client, course_name_list):
     Returns:
         str: 修正された文字列。表記ゆれがない場合は元の文字列を返します。
              APIエラーが発生した場合は、元の文字列をそのまま返します。
+
+    一度LLMで判定した文字列は対応表（course_aliases.json）に記録され、
+    次回以降はAPIを呼ばずに同じ結果を返します。
+    対応表にない場合もローカル照合のスコアが十分高ければ、LLMを呼ばずに正規名を返します。
     """
 
-    if input_string in course_name_list:
-        return input_string
+    resolved_text = resolve_course_name_locally(input_string, course_name_list)
+    if resolved_text is not None:
+        annotate(cache_hits=1)
+        return resolved_text
+    alias_table = get_alias_table()
 
     # プロンプトの準備
     # course_data_refを文字列に変換してプロンプトに含める
@@ -89,7 +425,8 @@ def correct_diving_course_spelling(input_string, llm_client, course_name_list):
     """
 
     try:
-        response = llm_client.chat.completions.create(
+        response = create_chat_completion(
+            llm_client,
             model="gpt-4.1-nano",
             messages=[
                 {
@@ -104,12 +441,117 @@ def correct_diving_course_spelling(input_string, llm_client, course_name_list):
         )
         corrected_text = response.choices[0].message.content.strip()
         corrected_text = json.loads(corrected_text)["corrected_text"]
+        alias_table.set(input_string, corrected_text)
         return corrected_text
     except Exception as e:
         print(f"OpenAI API呼び出し中にエラーが発生しました: {e}")
         return input_string  # エラー時は元の文字列を返す
 
 
+# バッチ修正用の出力スキーマ（Structured Outputs）
+BATCH_CORRECTION_SCHEMA = {
+    "name": "course_name_corrections",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "corrections": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "input": {"type": "string"},
+                        "corrected_text": {"type": "string"},
+                    },
+                    "required": ["input", "corrected_text"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["corrections"],
+        "additionalProperties": False,
+    },
+}
+
+
+@span("correct_diving_course_spellings")
+def correct_diving_course_spellings(input_strings, llm_client, course_name_list) -> dict:
+    """
+    複数のコース名の表記ゆれをまとめて修正します。
+
+    ローカルで解決できない文字列だけを集め、1回のLLM呼び出しでまとめて判定します。
+    判定結果は対応表に記録されます。
+
+    Args:
+        input_strings (list): 修正対象の文字列のリスト（重複可）。
+        llm_client (openai.OpenAI): 初期化済みのOpenAIクライアントインスタンス。
+        course_name_list (list): 参照する正規のコース/スペシャリティデータ。
+
+    Returns:
+        dict: 入力文字列から修正後の文字列への対応。
+              APIエラー時や判定できなかった文字列は、元の文字列に対応させます。
+    """
+    corrections = {}
+    unresolved = []
+    for input_string in dict.fromkeys(input_strings):
+        if not isinstance(input_string, str):
+            continue
+        resolved_text = resolve_course_name_locally(input_string, course_name_list)
+        if resolved_text is None:
+            unresolved.append(input_string)
+        else:
+            corrections[input_string] = resolved_text
+
+    annotate(items=len(corrections) + len(unresolved), cache_hits=len(corrections))
+    if not unresolved:
+        return corrections
+
+    prompt = f"""
+    以下のダイビングコースとスペシャリティの正規リストがあります。
+
+    {course_name_list}
+
+    以下の入力文字列のそれぞれについて、上記のリストのいずれかの項目と表記ゆれしている場合は、正規のリストの表記に修正してください。
+    もし、リストのどの項目とも関連がない、または表記ゆれではないと判断される場合は、入力された文字列をそのまま返してください。
+
+    入力文字列:
+    {json.dumps(unresolved, ensure_ascii=False)}
+
+    すべての入力文字列について、"input" に入力文字列をそのまま、"corrected_text" に修正後の文字列を入れてください。
+    """
+
+    alias_table = get_alias_table()
+    try:
+        response = create_chat_completion(
+            llm_client,
+            model="gpt-4.1-nano",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "あなたはダイビングコースとスペシャリティの表記ゆれを修正するアシスタントです。",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.0,
+            response_format={"type": "json_schema", "json_schema": BATCH_CORRECTION_SCHEMA},
+        )
+        result = json.loads(response.choices[0].message.content)
+        llm_corrections = {
+            item["input"]: item["corrected_text"]
+            for item in result["corrections"]
+            if item["input"] in unresolved
+        }
+        corrections.update(llm_corrections)
+        alias_table.update(llm_corrections)
+    except Exception as e:
+        print(f"OpenAI API呼び出し中にエラーが発生しました: {e}")
+
+    # 回答に含まれなかった文字列は元の文字列のままにする
+    for input_string in unresolved:
+        corrections.setdefault(input_string, input_string)
+    return corrections
+
+
 # 使用例
 if __name__ == "__main__":
     print("--- 表記ゆれ修正テスト ---")
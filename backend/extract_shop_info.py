@@ -1,11 +1,14 @@
-import json
 import os
 from typing import Optional
 from urllib.parse import urlparse
 
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, LLMConfig
+from crawl4ai import CrawlerRunConfig, LLMConfig
 from crawl4ai.extraction_strategy import LLMExtractionStrategy
+from crawler_pool import CrawlerPool
 from dotenv import load_dotenv
+from instrumentation import span
+from markdown_pruner import prune_shop_markdown
+from page_cache import crawl_and_extract
 from pydantic import BaseModel, Field
 
 # .envからAPIキーを読み込む
@@ -49,7 +52,9 @@ class ShopInfo(BaseModel):
 
 
 # 関数定義
-async def extract_shop_info(url: str) -> dict:
+async def extract_shop_info(
+    url: str, crawler_pool: CrawlerPool = None, checkpoint_key: str = None
+) -> dict:
     instruction = """
     以下のWebページの内容から、ダイビングショップの基本情報を抽出してください。
 
@@ -80,14 +85,19 @@ async def extract_shop_info(url: str) -> dict:
     config = CrawlerRunConfig(
         exclude_external_links=True,
         word_count_threshold=30,
-        extraction_strategy=strategy,
     )
 
-    async with AsyncWebCrawler() as crawler:
-        # breakpoint()
-        result = await crawler.arun(url=url, config=config)
-        content = json.loads(result.extracted_content)
-        content[0]["website"] = url  # 明示的にURLを代入
+    # ページ先頭と連絡先・所在地の周辺だけをLLMに渡す
+    with span("extract_shop_info"):
+        content = await crawl_and_extract(
+            url,
+            config,
+            strategy,
+            crawler_pool,
+            checkpoint_key=checkpoint_key,
+            prune=prune_shop_markdown,
+        )
+    content[0]["website"] = url  # 明示的にURLを代入
     return content
 
 
@@ -0,0 +1,94 @@
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+
+# ==== 設定 ====
+# 最終クロールからこの日数を過ぎたURLは、条件付きリクエストで更新を確認する（0は再確認しない）
+SHOP_REFRESH_MAX_AGE_DAYS = float(os.getenv("SHOP_REFRESH_MAX_AGE_DAYS", "0"))
+FRESHNESS_TIMEOUT_SECONDS = float(os.getenv("FRESHNESS_TIMEOUT_SECONDS", "20"))
+
+USER_AGENT = "Mozilla/5.0 (compatible; dive-file-crawler/1.0)"
+
+
+def normalize_status_record(record) -> Optional[dict]:
+    """
+    ステータスファイルの値を鮮度情報の辞書に揃える。
+    旧形式の True は、検証情報を持たない処理済みレコードとして扱う。
+    """
+    if record is True:
+        return {}
+    if isinstance(record, dict):
+        return record
+    return None
+
+
+def needs_refresh(record: Optional[dict], max_age_days: float = SHOP_REFRESH_MAX_AGE_DAYS) -> bool:
+    """
+    URLを処理（または更新確認）する必要があるかを判定する。
+
+    Args:
+        record (dict | None): normalize_status_recordで揃えた鮮度情報。未処理ならNone。
+        max_age_days (float): 再確認までの日数。0の場合、処理済みのURLは再確認しない。
+    """
+    if record is None:
+        return True
+    if max_age_days <= 0:
+        return False
+    crawled_at = record.get("crawled_at")
+    if not crawled_at:
+        return True
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(crawled_at)
+    return age >= timedelta(days=max_age_days)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=FRESHNESS_TIMEOUT_SECONDS,
+        headers={"User-Agent": USER_AGENT},
+    )
+
+
+async def check_freshness(
+    http_client: httpx.AsyncClient, url: str, record: Optional[dict]
+) -> dict:
+    """
+    ETag / Last-Modified を使った条件付きリクエストでページの更新有無を確認する。
+
+    304が返った場合、または本文のハッシュが前回と同じ場合は未更新とみなす。
+    リクエストに失敗した場合は、取りこぼしを防ぐため更新ありとして扱う。
+
+    Returns:
+        dict: {"changed": 更新の有無, "record": 次回用の鮮度情報}
+    """
+    record = record or {}
+    headers = {}
+    if record.get("etag"):
+        headers["If-None-Match"] = record["etag"]
+    if record.get("last_modified"):
+        headers["If-Modified-Since"] = record["last_modified"]
+
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        response = await http_client.get(url, headers=headers)
+    except httpx.HTTPError as e:
+        print(f"⚠️ 更新確認に失敗しました（再クロールします）: {url} ({e})")
+        return {"changed": True, "record": {**record, "crawled_at": now}}
+
+    if response.status_code == 304:
+        return {"changed": False, "record": {**record, "crawled_at": now}}
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    new_record = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+        "crawled_at": now,
+    }
+    changed = not (
+        response.status_code == 200 and record.get("content_hash") == content_hash
+    )
+    return {"changed": changed, "record": new_record}
@@ -2,6 +2,8 @@ import os
 
 import googlemaps
 from dotenv import load_dotenv
+from instrumentation import annotate, span
+from places_cache import PlacesCache, get_places_cache
 
 load_dotenv()
 
@@ -10,6 +12,13 @@ google_api_key = os.getenv("GOOGLE_API_KEY")
 query = "スクーバサポートサービスTRYS"  # 検索キーワード
 language_code = "ja"  # 日本語を指定
 
+# APIの上限到達・通信エラーとして扱う例外
+GMAPS_ERRORS = (
+    googlemaps.exceptions.ApiError,
+    googlemaps.exceptions.TransportError,
+    googlemaps.exceptions.Timeout,
+)
+
 # ==== クライアントの初期化 ====
 gmaps = googlemaps.Client(key=google_api_key)
 
@@ -39,16 +48,10 @@ def get_place_details(query: str, language_code: str = "ja"):
     return place_id
 
 
-def get_reviews(query: str, language_code: str = "ja"):
+def _fetch_reviews(place_id: str, language_code: str = "ja"):
     """
-    指定されたPlace IDでGoogle Mapsから場所の詳細と口コミを取得する関数。
-    :param query: 検索キーワード
-    :param language_code: 言語コード（デフォルトは日本語）
-    :return: 取得した場所の詳細と口コミ
+    Place IDの詳細情報と口コミをGoogle Mapsから取得する。
     """
-    place_id = get_place_details(query, language_code)
-    if not place_id:
-        return
     # ② 詳細情報を取得
     details_result = gmaps.place(
         place_id=place_id,
@@ -85,5 +88,45 @@ def get_reviews(query: str, language_code: str = "ja"):
         return
 
 
+@span("get_reviews")
+def get_reviews(
+    query: str, language_code: str = "ja", places_cache: PlacesCache = None
+):
+    """
+    指定されたPlace IDでGoogle Mapsから場所の詳細と口コミを取得する関数。
+    Place IDと口コミはキャッシュされ、キャッシュが有効な間はAPIを呼び出さない。
+    APIの上限やエラーで取得できない場合は、期限切れのキャッシュがあればそれを返す。
+    :param query: 検索キーワード
+    :param language_code: 言語コード（デフォルトは日本語）
+    :param places_cache: 使用するキャッシュ（省略時は共有キャッシュ）
+    :return: 取得した場所の詳細と口コミ
+    """
+    places_cache = places_cache or get_places_cache()
+    place_id = places_cache.get_place_id(query, language_code)
+    if not place_id:
+        place_id = get_place_details(query, language_code)
+        if not place_id:
+            return
+        places_cache.set_place_id(query, language_code, place_id)
+
+    cached = places_cache.get_details(place_id, language_code)
+    if cached is not None:
+        print(f"♻️ キャッシュ済みの口コミを使用します: {query}")
+        annotate(cache_hits=1)
+        return cached
+
+    try:
+        review_dict = _fetch_reviews(place_id, language_code)
+    except GMAPS_ERRORS as e:
+        stale = places_cache.get_details(place_id, language_code, allow_stale=True)
+        if stale is None:
+            raise
+        print(f"⚠️ 口コミの取得に失敗したため、期限切れのキャッシュを使用します: {query} ({e})")
+        return stale
+    if review_dict:
+        places_cache.set_details(place_id, language_code, review_dict)
+    return review_dict
+
+
 # review_list = get_reviews(query, language_code)
 # breakpoint()
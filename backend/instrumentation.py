@@ -0,0 +1,189 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Optional
+
+# ==== 設定 ====
+# 指定した場合、実行終了時に計測結果（全スパンと集計）をJSONで書き出す
+PIPELINE_METRICS_PATH = os.getenv("PIPELINE_METRICS_PATH", "")
+# レポートに表示する、処理時間の長いショップの件数
+SLOWEST_SHOPS_LIMIT = int(os.getenv("SLOWEST_SHOPS_LIMIT", "10"))
+
+# スパンに加算していく数値の属性（バイト数・トークン数・キャッシュヒット数など）
+COUNTER_KEYS = ("bytes", "tokens", "cache_hits", "rows", "items")
+
+# 現在処理中のショップ（URL）と、最も内側のスパン
+_current_shop: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_shop", default=None
+)
+_current_span: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class SpanRecorder:
+    """
+    ステージごとの処理時間と付随する数値（バイト数・トークン数・キャッシュヒットなど）を記録する。
+    スレッドから呼ばれても安全に記録できる。
+    """
+
+    def __init__(self):
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def summary(self) -> dict:
+        """
+        ステージごとの件数・p50・p95・合計時間・数値属性の合計と、処理時間の長いショップを返す。
+        """
+        with self._lock:
+            spans = list(self.spans)
+        durations = defaultdict(list)
+        counters = defaultdict(lambda: defaultdict(float))
+        errors = defaultdict(int)
+        for span in spans:
+            durations[span["stage"]].append(span["duration"])
+            for key in COUNTER_KEYS:
+                if key in span:
+                    counters[span["stage"]][key] += span[key]
+            if span.get("error"):
+                errors[span["stage"]] += 1
+
+        stages = {}
+        for stage, values in durations.items():
+            stages[stage] = {
+                "count": len(values),
+                "errors": errors[stage],
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "max": max(values),
+                "total": sum(values),
+                **dict(counters[stage]),
+            }
+        slowest_shops = sorted(
+            (
+                {"shop": span["shop"], "duration": span["duration"]}
+                for span in spans
+                if span["stage"] == "process_url" and span.get("shop")
+            ),
+            key=lambda item: item["duration"],
+            reverse=True,
+        )[:SLOWEST_SHOPS_LIMIT]
+        return {"stages": stages, "slowest_shops": slowest_shops}
+
+    def report(self) -> str:
+        """
+        summaryの内容を表形式の文字列にする。
+        """
+        summary = self.summary()
+        if not summary["stages"]:
+            return "（計測されたスパンはありません）"
+        lines = [
+            f"{'stage':<28}{'count':>7}{'err':>5}{'p50(s)':>9}{'p95(s)':>9}"
+            f"{'total(s)':>10}  counters"
+        ]
+        for stage, stats in sorted(
+            summary["stages"].items(), key=lambda item: item[1]["total"], reverse=True
+        ):
+            counter_text = " ".join(
+                f"{key}={int(stats[key]):,}" for key in COUNTER_KEYS if key in stats
+            )
+            lines.append(
+                f"{stage:<28}{stats['count']:>7}{stats['errors']:>5}"
+                f"{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['total']:>10.1f}"
+                f"  {counter_text}"
+            )
+        if summary["slowest_shops"]:
+            lines.append("")
+            lines.append("処理時間の長いショップ:")
+            for item in summary["slowest_shops"]:
+                lines.append(f"  {item['duration']:8.1f}s  {item['shop']}")
+        return "\n".join(lines)
+
+    def export_json(self, path: str):
+        """
+        全スパンと集計結果をJSONファイルに書き出す。
+        """
+        with self._lock:
+            spans = list(self.spans)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"summary": self.summary(), "spans": spans},
+                f,
+                indent=4,
+                ensure_ascii=False,
+                default=str,
+            )
+
+
+recorder = SpanRecorder()
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    ブロックの処理時間をステージ名とともに記録するコンテキストマネージャ。
+
+    with文の対象として渡される辞書に値を設定するか、annotateを呼ぶことで
+    バイト数・トークン数・キャッシュヒットなどをスパンに付け加えられる。
+    ブロック内で例外が発生した場合は、エラーとして記録したうえで再送出する。
+
+    Args:
+        stage (str): ステージ名（"process_url" など）。
+        **attributes: スパンに付け加える任意の属性。
+    """
+    record = {"stage": stage, "shop": _current_shop.get(), **attributes}
+    token = _current_span.set(record)
+    started_at = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration"] = time.perf_counter() - started_at
+        _current_span.reset(token)
+        recorder.add(record)
+
+
+def annotate(**counters):
+    """
+    最も内側のスパンに数値を加算する（スパンの外で呼ばれた場合は何もしない）。
+    asyncio.to_threadで実行中の関数からも、呼び出し元のスパンに加算される。
+    """
+    record = _current_span.get()
+    if record is None:
+        return
+    for key, value in counters.items():
+        record[key] = record.get(key, 0) + value
+
+
+@contextmanager
+def shop_context(shop: str):
+    """
+    ブロック内で記録されるスパンを、指定したショップ（URL）に紐付ける。
+    """
+    token = _current_shop.set(shop)
+    try:
+        yield
+    finally:
+        _current_shop.reset(token)
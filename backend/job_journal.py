@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from freshness import normalize_status_record
+
+# ==== 設定 ====
+JOB_JOURNAL_PATH = os.getenv("JOB_JOURNAL_PATH", "output/job_journal.sqlite3")
+
+# URLごとの処理ステージ（この順に進む）
+STAGE_CRAWLED = "crawled"  # 更新を検出し、取得・抽出を開始した
+STAGE_EXTRACTED = "extracted"  # 抽出結果を出力ファイルに保存した
+STAGE_ENRICHED = "enriched"  # 抽出結果をショップ単位の統合結果に取り込んだ
+STAGE_SAVED = "saved"  # 統合結果をDBに保存した
+STAGES = (STAGE_CRAWLED, STAGE_EXTRACTED, STAGE_ENRICHED, STAGE_SAVED)
+# ステージを進めず、鮮度情報（確認日時など）だけを更新するイベント
+EVENT_CHECKED = "checked"
+
+
+class JobJournal:
+    """
+    URLごとの処理ステージを追記していくジャーナル（SQLiteのWALモード）。
+
+    イベントは追記のみで書き換えないため、処理の途中でプロセスが終了しても
+    それまでに記録したステージは失われない。再実行時は、各URLの最後に完了した
+    ステージから処理を再開できる。
+    """
+
+    def __init__(self, path: str = JOB_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+
+    def record(self, url: str, stage: str, data: dict = None):
+        """
+        URLのイベントを1件追記する。
+
+        Args:
+            url (str): 対象のURL。
+            stage (str): STAGESのいずれか、またはEVENT_CHECKED。
+            data (dict, optional): イベントに付随する情報。
+                                   "freshness"キーがあれば、そのURLの鮮度情報として扱う。
+        """
+        payload = json.dumps(data or {}, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO events (url, stage, data, created_at) VALUES (?, ?, ?, ?)",
+                (url, stage, payload, time.time()),
+            )
+
+    def states(self) -> Dict[str, dict]:
+        """
+        イベントを先頭から畳み込み、URLごとの現在の状態を返す。
+
+        Returns:
+            Dict[str, dict]: {URL: {"stage": 最後に完了したステージ,
+                                    "record": 鮮度情報, "data": 最後のステージのデータ}}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, stage, data FROM events ORDER BY id"
+            ).fetchall()
+        states = {}
+        for url, stage, payload in rows:
+            data = json.loads(payload)
+            state = states.setdefault(url, {"stage": None, "record": None, "data": {}})
+            if "freshness" in data:
+                state["record"] = data["freshness"]
+            if stage != EVENT_CHECKED:
+                state["stage"] = stage
+                state["data"] = data
+        return states
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM events LIMIT 1").fetchone()
+        return row is None
+
+    def migrate_status_file(self, status_path: str) -> int:
+        """
+        旧形式のステータスファイル（shop_status.json）の内容を、統合済みのURLとして取り込む。
+        ジャーナルが空の場合だけ取り込み、ステータスファイル自体は変更しない。
+
+        Returns:
+            int: 取り込んだURLの数。
+        """
+        if not self.is_empty():
+            return 0
+        try:
+            with open(status_path, "r", encoding="utf-8") as f:
+                shop_status = json.load(f)
+        except FileNotFoundError:
+            return 0
+        count = 0
+        for url, value in shop_status.items():
+            record = normalize_status_record(value)
+            if record is None:
+                continue
+            self.record(url, STAGE_ENRICHED, {"freshness": record, "migrated": True})
+            count += 1
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,246 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+import openai
+from dotenv import load_dotenv
+from instrumentation import annotate
+
+load_dotenv()
+openai_api_key = os.getenv("OPENAI_API_KEY")
+
+# ==== 設定 ====
+# レート制限（1分あたりのリクエスト数・トークン数）
+OPENAI_MAX_RPM = float(os.getenv("OPENAI_MAX_RPM", "500"))
+OPENAI_MAX_TPM = float(os.getenv("OPENAI_MAX_TPM", "200000"))
+# 429/5xx時のリトライ回数と待機時間（秒）
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1.0"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "60.0"))
+# 1回の実行あたりの上限（0は無制限）
+OPENAI_TOKEN_BUDGET = int(os.getenv("OPENAI_TOKEN_BUDGET", "0"))
+OPENAI_COST_BUDGET_USD = float(os.getenv("OPENAI_COST_BUDGET_USD", "0"))
+
+# strategy.runのエラーブロックのうち、リトライ対象とみなすメッセージ
+RETRYABLE_ERROR_PATTERN = re.compile(
+    r"rate.?limit|overloaded|\b429\b|\b5\d\d\b", re.IGNORECASE
+)
+
+# モデルごとの料金（USD / 100万トークン）: (入力, 出力)
+MODEL_PRICES = {
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4o-search-preview": (2.50, 10.00),
+}
+
+
+class LLMBudgetExceededError(Exception):
+    """実行あたりのトークン数・コストの上限に達したときに送出される例外。"""
+
+
+class TokenBucket:
+    """
+    1分あたりの上限からトークンを補充するトークンバケット。
+    acquireは必要な量が貯まるまで呼び出し元のスレッドをブロックする。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        # 容量を超える要求は、容量分が貯まった時点で通す
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class LLMBudget:
+    """
+    実行全体のトークン使用量とコストを集計し、上限を超えたら以降の呼び出しを止める。
+    """
+
+    def __init__(self, max_tokens: int = 0, max_cost_usd: float = 0.0):
+        self.max_tokens = max_tokens
+        self.max_cost_usd = max_cost_usd
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def check(self):
+        if self.max_tokens and self.total_tokens >= self.max_tokens:
+            raise LLMBudgetExceededError(
+                f"トークン上限に達しました: {self.total_tokens:,} / {self.max_tokens:,}"
+            )
+        if self.max_cost_usd and self.cost_usd >= self.max_cost_usd:
+            raise LLMBudgetExceededError(
+                f"コスト上限に達しました: ${self.cost_usd:.4f} / ${self.max_cost_usd:.4f}"
+            )
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int):
+        input_price, output_price = MODEL_PRICES.get(
+            model.split("/")[-1], (0.0, 0.0)
+        )
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += (
+                prompt_tokens * input_price + completion_tokens * output_price
+            ) / 1_000_000
+
+    def summary(self) -> str:
+        return (
+            f"リクエスト {self.requests:,}件 / 入力 {self.prompt_tokens:,} トークン / "
+            f"出力 {self.completion_tokens:,} トークン / 推定コスト ${self.cost_usd:.4f}"
+        )
+
+
+request_bucket = TokenBucket(OPENAI_MAX_RPM)
+token_bucket = TokenBucket(OPENAI_MAX_TPM)
+budget = LLMBudget(OPENAI_TOKEN_BUDGET, OPENAI_COST_BUDGET_USD)
+
+_client: Optional[openai.OpenAI] = None
+
+
+def get_openai_client() -> openai.OpenAI:
+    """
+    共有のOpenAIクライアントを返す。
+    リトライはこのモジュールで行うため、SDK側の自動リトライは無効にしている。
+    """
+    global _client
+    if _client is None:
+        _client = openai.OpenAI(api_key=openai_api_key, max_retries=0)
+    return _client
+
+
+def estimate_tokens(text: str) -> int:
+    # 日本語は1文字あたり約1トークンになるため、文字数をそのまま見積もりに使う
+    return len(text)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(
+        error,
+        (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError),
+    ):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _backoff_seconds(attempt: int, error: Exception = None) -> float:
+    """
+    Retry-Afterヘッダがあればそれに従い、なければジッター付き指数バックオフで待機時間を決める。
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), OPENAI_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2**attempt))
+
+
+def _acquire(estimated_tokens: int):
+    budget.check()
+    request_bucket.acquire()
+    token_bucket.acquire(estimated_tokens)
+
+
+def create_chat_completion(llm_client: openai.OpenAI = None, **kwargs):
+    """
+    レート制限・リトライ・予算管理付きで chat.completions.create を呼び出す。
+
+    Args:
+        llm_client (openai.OpenAI, optional): 使用するクライアント。省略時は共有クライアント。
+        **kwargs: chat.completions.create にそのまま渡す引数。
+
+    Returns:
+        ChatCompletion: OpenAI APIのレスポンス。
+
+    Raises:
+        LLMBudgetExceededError: 実行あたりの上限に達している場合。
+        openai.OpenAIError: リトライしても成功しなかった場合、またはリトライ対象外のエラー。
+    """
+    llm_client = llm_client or get_openai_client()
+    prompt_text = "".join(
+        str(message.get("content", "")) for message in kwargs.get("messages", [])
+    )
+    estimated_tokens = estimate_tokens(prompt_text) + kwargs.get("max_tokens", 1000)
+
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        _acquire(estimated_tokens)
+        try:
+            response = llm_client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if attempt >= OPENAI_MAX_RETRIES or not _is_retryable(e):
+                raise
+            wait = _backoff_seconds(attempt, e)
+            print(f"⏳ OpenAI APIエラーのため{wait:.1f}秒後にリトライします: {e}")
+            time.sleep(wait)
+            continue
+
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            budget.record(
+                kwargs.get("model", ""), usage.prompt_tokens, usage.completion_tokens
+            )
+            annotate(tokens=usage.prompt_tokens + usage.completion_tokens)
+        return response
+
+
+def run_llm_extraction(strategy, url: str, sections: list) -> list:
+    """
+    crawl4aiのLLMExtractionStrategyを、レート制限・リトライ・予算管理付きで実行する。
+
+    strategy.run はエラー時に例外ではなくエラーブロックを返すため、
+    レート制限やサーバーエラーを示すブロックが含まれていればリトライする。
+    """
+    estimated_tokens = estimate_tokens("".join(sections)) + estimate_tokens(
+        strategy.instruction or ""
+    )
+    extracted = []
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        _acquire(estimated_tokens)
+        prompt_before = strategy.total_usage.prompt_tokens
+        completion_before = strategy.total_usage.completion_tokens
+        extracted = strategy.run(url, sections)
+        prompt_tokens = strategy.total_usage.prompt_tokens - prompt_before
+        completion_tokens = strategy.total_usage.completion_tokens - completion_before
+        budget.record(strategy.llm_config.provider, prompt_tokens, completion_tokens)
+        annotate(tokens=prompt_tokens + completion_tokens)
+
+        retryable = any(
+            RETRYABLE_ERROR_PATTERN.search(str(block.get("content", "")))
+            for block in extracted
+            if isinstance(block, dict) and block.get("error")
+        )
+        if not retryable or attempt >= OPENAI_MAX_RETRIES:
+            return extracted
+        wait = _backoff_seconds(attempt)
+        print(f"⏳ LLM抽出がレート制限に達したため{wait:.1f}秒後にリトライします: {url}")
+        time.sleep(wait)
+    return extracted
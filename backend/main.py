@@ -5,26 +5,69 @@ import re
 from typing import List
 from urllib.parse import urlparse
 
+import httpx
 import pandas as pd
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, LLMConfig
+from checkpoints import get_checkpoints, run_stage
+from crawl4ai import CrawlerRunConfig, LLMConfig
 from crawl4ai.extraction_strategy import LLMExtractionStrategy
-from database.database_handler import save_to_db
-from diving_course_normalizer import correct_diving_course_spelling
+from crawler_pool import CrawlerPool
+from database.database_handler import asave_to_db
+from database.supabase_client import create_async_client
+from diving_course_normalizer import correct_diving_course_spellings
 from dotenv import load_dotenv
 from extract_shop_info import extract_shop_info
+from freshness import check_freshness, create_http_client, needs_refresh
 from get_place_details import get_reviews
-from openai import OpenAI
+from instrumentation import (
+    PIPELINE_METRICS_PATH,
+    recorder,
+    shop_context,
+    span,
+)
+from job_journal import (
+    EVENT_CHECKED,
+    JOB_JOURNAL_PATH,
+    STAGE_CRAWLED,
+    STAGE_ENRICHED,
+    STAGE_EXTRACTED,
+    STAGE_SAVED,
+    JobJournal,
+)
+from llm_client import budget, create_chat_completion, get_openai_client
+from markdown_pruner import prune_course_markdown
+from page_cache import crawl_and_extract
 from pydantic import BaseModel, Field
-from scripts.apply_course_description import apply_course_description
+from scripts.apply_course_description import (
+    apply_course_description,
+    build_course_table,
+    nest_courses,
+)
+from shop_merger import ShopMerger
+from supabase import AsyncClient
 
 # 環境変数の読み込み
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=openai_api_key)
+client = get_openai_client()
+
+# コース詳細情報のファイル
+COURSE_DESCRIPTION_PATH = "backend/course_description.json"
 
 # 正規表現パターン
 pattern = r"^(https?://)([^/]+)"
 
+# 並列実行数の設定（同時に処理するショップ数と、外部サービスごとの同時実行数）
+MAX_CONCURRENT_SHOPS = int(os.getenv("MAX_CONCURRENT_SHOPS", "4"))
+MAX_CONCURRENT_CRAWLS = int(os.getenv("MAX_CONCURRENT_CRAWLS", "2"))
+MAX_CONCURRENT_OPENAI = int(os.getenv("MAX_CONCURRENT_OPENAI", "4"))
+MAX_CONCURRENT_GMAPS = int(os.getenv("MAX_CONCURRENT_GMAPS", "2"))
+
+# クロール中に、新規・更新されたショップがこの件数たまるごとにDBへ保存する（0の場合はクロール後にまとめて保存）
+DB_SAVE_BATCH_SIZE = int(os.getenv("DB_SAVE_BATCH_SIZE", "50"))
+
+openai_semaphore = asyncio.Semaphore(MAX_CONCURRENT_OPENAI)
+gmaps_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GMAPS)
+
 
 # モデル定義
 class Course(BaseModel):
@@ -88,8 +131,10 @@ def get_web_search_prompt(hostname: str, license_list, specialty_list) -> str:
     """
 
 
+@span("search_web")
 def search_web(query):
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o-search-preview",
         web_search_options={
             "search_context_size": "high",
@@ -106,7 +151,25 @@ extract_prompt = """
 """
 
 
-async def extract_course_info_from_url(url: str, license_list, specialty_list) -> dict:
+def build_course_ids(license_list, specialty_list) -> dict:
+    """
+    正規のコース名に短いID（ライセンスはL1〜、スペシャリティはS1〜）を振る。
+    プロンプトと抽出結果のコース名をIDで表し、トークン数を減らすために使う。
+    """
+    course_ids = {f"L{i}": name for i, name in enumerate(license_list, 1)}
+    course_ids.update({f"S{i}": name for i, name in enumerate(specialty_list, 1)})
+    return course_ids
+
+
+async def extract_course_info_from_url(
+    url: str,
+    license_list,
+    specialty_list,
+    crawler_pool: CrawlerPool = None,
+    checkpoint_key: str = None,
+) -> dict:
+    course_ids = build_course_ids(license_list, specialty_list)
+    course_id_text = " / ".join(f"{key}={name}" for key, name in course_ids.items())
     llm_strategy = LLMExtractionStrategy(
         llm_config=LLMConfig(provider="openai/gpt-4.1-nano", api_token=openai_api_key),
         schema=ArticleData.model_json_schema(),
@@ -114,20 +177,28 @@ async def extract_course_info_from_url(url: str, license_list, specialty_list) -
         force_json_response=True,
         instruction=f"""
         以下のWebページの内容から、ダイビングショップのコース情報を抽出してください。
-        {license_list}
-        {specialty_list}
+        コースが次の一覧のいずれかに当たる場合、nameにはコース名ではなくIDを入れてください。
+        一覧にないコースは、ページ上の表記のままnameに入れてください。
+        {course_id_text}
         """,
     )
     config = CrawlerRunConfig(
         exclude_external_links=True,
         word_count_threshold=20,
-        extraction_strategy=llm_strategy,
         remove_forms=True,
         exclude_internal_links=True,
     )
-    async with AsyncWebCrawler() as crawler:
-        result = await crawler.arun(url=url, config=config)
-        return json.loads(result.extracted_content)
+    # 料金表・金額・コース名の周辺だけをLLMに渡す。
+    # 絞り込んだ内容が前回と同じなら、キャッシュ済みの抽出結果を使いLLMを呼ばない
+    course_name_list = license_list + specialty_list
+    return await crawl_and_extract(
+        url,
+        config,
+        llm_strategy,
+        crawler_pool,
+        checkpoint_key=checkpoint_key,
+        prune=lambda markdown: prune_course_markdown(markdown, course_name_list),
+    )
 
 
 def merge_and_clean_course_info(course_info_dict, web_search_json, target_url):
@@ -156,41 +227,160 @@ def save_result(data: dict, filename: str, output_dir: str):
     print(f"✅ 保存完了: {path}")
 
 
-async def process_url(target_url: str, license_list, specialty_list, output_dir: str):
-    # try:
-    print(f"\n🔍 処理中: {target_url}")
-    hostname = re.match(pattern, target_url).group(0)
+async def fetch_course_info(
+    target_url: str,
+    license_list,
+    specialty_list,
+    crawler_pool: CrawlerPool = None,
+    checkpoint_key: str = None,
+) -> dict:
+    """
+    ステージ1: 対象ページからコース情報を抽出する。
+    """
     course_info_json = await extract_course_info_from_url(
-        target_url, license_list, specialty_list
+        target_url, license_list, specialty_list, crawler_pool, checkpoint_key
     )
-    shop_info_json = await extract_shop_info(hostname)
-
     course_info_dict = (
         course_info_json[0] if isinstance(course_info_json, list) else course_info_json
     )
-    course_name_list = license_list + specialty_list
-    course_info_dict["name"] = correct_diving_course_spelling(
-        course_info_dict["name"], client, course_name_list
-    )
-    shop_info_dict = (
-        shop_info_json[0] if isinstance(shop_info_json, list) else shop_info_json
-    )
-
     if "course_list" not in course_info_dict:
         course_info_dict = {"course_list": course_info_dict}
-
+    if isinstance(course_info_dict["course_list"], dict):
+        course_info_dict["course_list"] = [course_info_dict["course_list"]]
+    # IDで返されたコース名を正規名に戻す
+    course_ids = build_course_ids(license_list, specialty_list)
+    for course in course_info_dict["course_list"]:
+        if isinstance(course, dict) and isinstance(course.get("name"), str):
+            course["name"] = course_ids.get(course["name"].strip(), course["name"])
+    return course_info_dict
+
+
+async def fetch_web_search_courses(
+    hostname: str, license_list, specialty_list, checkpoint_key: str = None
+) -> dict:
+    """
+    ステージ2: Web検索でコース情報を取得し、JSONとして再抽出する。
+    """
     web_search_prompt = get_web_search_prompt(hostname, license_list, specialty_list)
-    course_info_text = search_web(web_search_prompt)
 
-    response = client.chat.completions.create(
-        model="gpt-4.1-nano",
-        temperature=0.0,
-        messages=[
-            {"role": "user", "content": extract_prompt.format(text=course_info_text)}
-        ],
-        response_format={"type": "json_object"},
+    async def run_search() -> str:
+        async with openai_semaphore:
+            return await asyncio.to_thread(search_web, web_search_prompt)
+
+    # 検索結果のテキストは、JSONへの再抽出が失敗しても再利用できるよう個別に保存する
+    course_info_text = await run_stage(checkpoint_key, "web_search_text", run_search)
+
+    async with openai_semaphore:
+        with span("web_search_extract"):
+            response = await asyncio.to_thread(
+                create_chat_completion,
+                client,
+                model="gpt-4.1-nano",
+                temperature=0.0,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": extract_prompt.format(text=course_info_text),
+                    }
+                ],
+                response_format={"type": "json_object"},
+            )
+    return json.loads(response.choices[0].message.content)
+
+
+async def fetch_shop_info_and_reviews(
+    hostname: str, crawler_pool: CrawlerPool = None, checkpoint_key: str = None
+) -> tuple:
+    """
+    ステージ3: トップページから店舗情報を抽出し、その店舗名でGoogle Mapsの口コミを取得する。
+    口コミの取得は店舗名に依存するため、店舗情報の抽出後に続けて実行する。
+    """
+
+    async def run_shop_extraction() -> dict:
+        shop_info_json = await extract_shop_info(
+            hostname, crawler_pool, checkpoint_key
+        )
+        return shop_info_json[0] if isinstance(shop_info_json, list) else shop_info_json
+
+    async def run_reviews():
+        async with gmaps_semaphore:
+            return await asyncio.to_thread(get_reviews, shop_info_dict["name"])
+
+    shop_info_dict = await run_stage(
+        checkpoint_key, "shop_extraction", run_shop_extraction
+    )
+    reviews_dict = None
+    if shop_info_dict.get("name"):
+        reviews_dict = await run_stage(checkpoint_key, "reviews", run_reviews)
+    return shop_info_dict, reviews_dict
+
+
+async def normalize_course_names(course_lists: List[list], course_name_list):
+    """
+    複数のコースリストに含まれるコース名を、1回のバッチ呼び出しで正規名に揃える（リストを直接更新）。
+    """
+    courses = [
+        course
+        for course_list in course_lists
+        if isinstance(course_list, list)
+        for course in course_list
+        if isinstance(course, dict) and isinstance(course.get("name"), str)
+    ]
+    if not courses:
+        return
+    async with openai_semaphore:
+        corrections = await asyncio.to_thread(
+            correct_diving_course_spellings,
+            [course["name"] for course in courses],
+            client,
+            course_name_list,
+        )
+    for course in courses:
+        course["name"] = corrections.get(course["name"], course["name"])
+
+
+async def process_url(
+    target_url: str,
+    license_list,
+    specialty_list,
+    output_dir: str,
+    crawler_pool: CrawlerPool = None,
+) -> dict:
+    """
+    1つのURLを処理して結果を出力ディレクトリに保存し、ショップ情報を返す。
+    コース情報のマージに失敗した場合はNoneを返す。
+    """
+    print(f"\n🔍 処理中: {target_url}")
+    hostname = re.match(pattern, target_url).group(0)
+    course_name_list = license_list + specialty_list
+
+    # 互いに依存しないステージ（コース抽出・Web検索・店舗情報+口コミ）を同時に実行する
+    # 各ステージの結果はURLをキーに保存され、後続の処理が失敗しても再実行時に再利用される
+    course_info_dict, web_search_json, (shop_info_dict, reviews_dict) = (
+        await asyncio.gather(
+            run_stage(
+                target_url,
+                "course_extraction",
+                lambda: fetch_course_info(
+                    target_url, license_list, specialty_list, crawler_pool, target_url
+                ),
+            ),
+            run_stage(
+                target_url,
+                "web_search",
+                lambda: fetch_web_search_courses(
+                    hostname, license_list, specialty_list, target_url
+                ),
+            ),
+            fetch_shop_info_and_reviews(hostname, crawler_pool, target_url),
+        )
+    )
+
+    # ページ抽出とWeb検索の両方のコース名を正規名に揃えてから重複を除く
+    await normalize_course_names(
+        [course_info_dict["course_list"], web_search_json.get("course_list", [])],
+        course_name_list,
     )
-    web_search_json = json.loads(response.choices[0].message.content)
     merged = merge_and_clean_course_info(course_info_dict, web_search_json, target_url)
     if merged is None:
         return
@@ -215,13 +405,12 @@ async def process_url(target_url: str, license_list, specialty_list, output_dir:
     }
 
     shop_info_dict.update(merged)
-    if shop_info_dict.get("name"):
-        reviews_dict = get_reviews(shop_info_dict["name"])
-        if reviews_dict:
-            shop_info_dict.update(reviews_dict)
+    if reviews_dict:
+        shop_info_dict.update(reviews_dict)
 
     filename = sanitize_filename(target_url)
     save_result(shop_info_dict, filename, output_dir)
+    return shop_info_dict
 
 
 def load_json(path: str) -> List[dict]:
@@ -229,31 +418,6 @@ def load_json(path: str) -> List[dict]:
         return json.load(f)
 
 
-def merge_dive_shop_info(df: pd.DataFrame) -> pd.DataFrame:
-    def merge_rows(group):
-        first_row = group.iloc[0].copy()
-
-        # course_list 統合
-        all_courses = []
-        for courses in group["course_list"]:
-            all_courses.extend(courses)
-        all_course_list = []
-        name_list = []
-        for course in all_courses:
-            if course["name"] in name_list:
-                print(f"Duplicate course name found: {course['name']}")
-                continue
-            all_course_list.append(course)
-            name_list.append(course["name"])
-        first_row["course_list"] = all_course_list
-        return first_row
-
-    merged_df = (
-        df.groupby("name", as_index=False).apply(merge_rows).reset_index(drop=True)
-    )
-    return merged_df
-
-
 async def main():
     license_list, specialty_list = load_license_data("backend/dive_info.json")
     output_dir = "output"
@@ -262,62 +426,245 @@ async def main():
 
     shop_entries = load_json(shop_urls_path)
 
-    # ステータスファイルを読み込む（なければ空の辞書）
-    try:
-        with open(shop_status_path, "r", encoding="utf-8") as f:
-            shop_status = json.load(f)
-    except FileNotFoundError:
-        shop_status = {}
+    # URLごとの処理ステージを記録するジャーナル。初回は旧形式のステータスファイルを取り込む
+    journal = JobJournal(JOB_JOURNAL_PATH)
+    migrated = journal.migrate_status_file(shop_status_path)
+    if migrated:
+        print(f"📦 {shop_status_path} から{migrated}件のURLをジャーナルに移行しました。")
+    url_states = journal.states()
+
+    # ショップ名ごとの統合結果。前回の状態保存以降に書き出された出力ファイルも取り込む
+    merger = ShopMerger(os.path.join(output_dir, "merged_shops_state.json"))
+    merger.add_from_output_dir(output_dir)
+
+    shop_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SHOPS)
+    # DBへの保存が済んでいない、統合済みのURL
+    enriched_urls = {
+        url for url, state in url_states.items() if state["stage"] == STAGE_ENRICHED
+    }
 
+    # クロール中のDB保存の要求と、クロールの完了を伝えるイベント
+    save_requested = asyncio.Event()
+    crawl_finished = asyncio.Event()
+
+    async def save_during_crawl(db_client: AsyncClient, http_client: httpx.AsyncClient):
+        """
+        クロールと並行して、新規・更新されたショップがたまるごとにDBへ保存する。
+        保存に失敗した場合は、残りをクロール後の保存に任せる。
+        """
+        while True:
+            await save_requested.wait()
+            save_requested.clear()
+            if crawl_finished.is_set():
+                return
+            saved = await save_changed_shops(
+                merger, journal, enriched_urls, db_client, http_client
+            )
+            if not saved:
+                return
+
+    async def run_entry(
+        entry: dict, crawler_pool: CrawlerPool, http_client: httpx.AsyncClient
+    ):
+        url = entry["url"]
+        state = url_states.get(url) or {"stage": None, "record": None, "data": {}}
+        async with shop_semaphore:
+            try:
+                output_path = os.path.join(output_dir, sanitize_filename(url))
+                if state["stage"] == STAGE_EXTRACTED and os.path.exists(output_path):
+                    # 抽出結果は保存済みのため、出力ファイルから統合を再開する
+                    print(f"⏩ {entry.get('name', url)} を統合ステージから再開します。")
+                    shop_info = await asyncio.to_thread(load_json, output_path)
+                else:
+                    if state["stage"] in (STAGE_CRAWLED, STAGE_EXTRACTED):
+                        # 前回、更新を検出した後に中断されたURLは確認を省いて再処理する
+                        print(f"⏩ {entry.get('name', url)} の抽出を再開します。")
+                    else:
+                        # 条件付きリクエストで更新を確認し、未更新なら抽出もDB保存も行わない
+                        record = state["record"]
+                        with span("check_freshness"):
+                            freshness = await check_freshness(http_client, url, record)
+                        if record is not None and not freshness["changed"]:
+                            print(
+                                f"✅ {entry.get('name', url)} は更新されていません。スキップします。"
+                            )
+                            journal.record(
+                                url,
+                                EVENT_CHECKED,
+                                {"freshness": {**record, **freshness["record"]}},
+                            )
+                            return
+                        # ETag・Last-Modified・ハッシュ・取得日時を記録し、
+                        # 更新前のページから作った中間結果を破棄する
+                        get_checkpoints().clear(url)
+                        journal.record(
+                            url, STAGE_CRAWLED, {"freshness": freshness["record"]}
+                        )
+                    print(f"🔍 {entry.get('name', url)} を処理中...")
+                    with shop_context(url), span("process_url"):
+                        shop_info = await process_url(
+                            url, license_list, specialty_list, output_dir, crawler_pool
+                        )
+                    if not shop_info:
+                        # マージに失敗した場合は、次回の実行で抽出からやり直す
+                        return
+                    journal.record(
+                        url, STAGE_EXTRACTED, {"output": sanitize_filename(url)}
+                    )
+                    # 出力ファイルに保存したため、ステージごとの中間結果は不要になる
+                    get_checkpoints().clear(url)
+                # 処理が終わったショップから順に統合する
+                merger.add(sanitize_filename(url), shop_info)
+                journal.record(url, STAGE_ENRICHED)
+                enriched_urls.add(url)
+                if DB_SAVE_BATCH_SIZE and len(merger.changed_names) >= DB_SAVE_BATCH_SIZE:
+                    save_requested.set()
+            except Exception as e:
+                print(
+                    f"❌ {entry.get('name', url)} の処理中にエラーが発生しました: {e}"
+                )
+                # エラーが発生した場合はステージを進めない（リトライ可能にする）
+
+    pending_entries = []
     for entry in shop_entries:
         url = entry["url"]
-        # URLをキーとしてステータスをチェック
-        if shop_status.get(url):
+        state = url_states.get(url)
+        # 途中のステージで中断されたURLは再開する。統合まで済んだURLは
+        # SHOP_REFRESH_MAX_AGE_DAYSを過ぎたものだけ再確認する
+        if (
+            state is not None
+            and state["stage"] in (STAGE_ENRICHED, STAGE_SAVED)
+            and not needs_refresh(state["record"])
+        ):
             print(f"✅ {entry.get('name', url)} は既に処理済みです。スキップします。")
             continue
+        pending_entries.append(entry)
 
-        try:
-            print(f"🔍 {entry.get('name', url)} を処理中...")
-            await process_url(url, license_list, specialty_list, output_dir)
-            # 処理成功後、ステータスを更新
-            shop_status[url] = True
-        except Exception as e:
-            print(f"❌ {entry.get('name', url)} の処理中にエラーが発生しました: {e}")
-            # エラーが発生した場合はステータスを更新しない（リトライ可能にする）
-            continue
-        finally:
-            # 定期的にステータスをファイルに書き込む
-            with open(shop_status_path, "w", encoding="utf-8") as f:
-                json.dump(shop_status, f, indent=4, ensure_ascii=False)
-
-    print("\n✨ すべてのURLの処理が完了しました。")
+    print(
+        f"🚀 {len(pending_entries)}件のURLを最大{MAX_CONCURRENT_SHOPS}件ずつ並列に処理します。"
+    )
+    try:
+        # ブラウザは実行全体で1つだけ起動し、MAX_CONCURRENT_CRAWLS枚のページを使い回す
+        async with (
+            CrawlerPool(size=MAX_CONCURRENT_CRAWLS) as crawler_pool,
+            create_http_client() as http_client,
+            create_async_client() as db_client,
+        ):
+            save_task = asyncio.create_task(save_during_crawl(db_client, http_client))
+            try:
+                await asyncio.gather(
+                    *(
+                        run_entry(entry, crawler_pool, http_client)
+                        for entry in pending_entries
+                    )
+                )
+            finally:
+                # 保存中のバッチは最後まで実行させる
+                crawl_finished.set()
+                save_requested.set()
+                await save_task
+
+            print("\n✨ すべてのURLの処理が完了しました。")
+            print(f"🧮 OpenAI使用量: {budget.summary()}")
+            await postprocess(
+                merger, journal, enriched_urls, output_dir, db_client, http_client
+            )
+    finally:
+        journal.close()
+        print(f"\n⏱️ ステージごとの処理時間:\n{recorder.report()}")
+        if PIPELINE_METRICS_PATH:
+            recorder.export_json(PIPELINE_METRICS_PATH)
+            print(f"📊 計測結果を出力しました: {PIPELINE_METRICS_PATH}")
+
+
+async def save_changed_shops(
+    merger: ShopMerger,
+    journal: JobJournal,
+    enriched_urls: set,
+    db_client: AsyncClient,
+    http_client: httpx.AsyncClient,
+) -> bool:
+    """
+    新規・更新されたショップにコース詳細を付与してDBに保存する。
 
-    # --- 後続処理（データマージ、DB保存、CSV出力）---
-    path_list = [p for p in os.listdir(output_dir) if p.endswith(".json")]
-    if not path_list:
-        print("\n⚠️ 処理されたデータがありません。後続処理をスキップします。")
-        return
+    保存に失敗したショップと、画像の処理に失敗したショップは未処理のまま残し、次の保存で再度渡す。
+    保存が済んだショップに属する統合済みのURLは、ジャーナルに保存済みとして記録する。
 
-    data_list = []
-    for file_name in path_list:
-        with open(os.path.join(output_dir, file_name), "r", encoding="utf-8") as f:
-            data = json.load(f)
-        data_list.append(data)
+    Returns:
+        bool: DBへの保存に成功した場合はTrue（画像の処理に失敗したショップがあってもTrue）。
+    """
+    names = merger.begin_delivery()
+    image_failed_names = []
+    if names:
+        # DBには新規・更新されたショップだけを渡す
+        print(f"\n🔄 {len(names)}件の新規・更新されたショップをDBに保存します。")
+        changed_df = pd.DataFrame(list(merger.records(names)))
+
+        # course_description.jsonからコース詳細情報を適用
+        # 展開したコース表はDB保存でもそのまま使う
+        def build_tables():
+            with span("build_course_table", rows=len(changed_df)):
+                courses_df = build_course_table(changed_df, COURSE_DESCRIPTION_PATH)
+                return nest_courses(changed_df, courses_df), courses_df
+
+        changed_df, changed_courses_df = await asyncio.to_thread(build_tables)
+
+        saved, image_failed_names = await asave_to_db(
+            db_client, changed_df, courses_df=changed_courses_df, http_client=http_client
+        )
+        # 画像の処理に失敗したショップは、次の保存で画像を処理し直すため未処理に戻す
+        merger.end_delivery(names, failed=image_failed_names if saved else names)
+        merger.save()
+        if not saved:
+            print("⚠️ DBへの保存に失敗したため、変更のあったショップは次回の保存で再度保存します。")
+            return False
+
+    # 未処理のショップに属さないURLは、内容がDBに反映済み
+    pending_names = merger.pending_names()
+    for url in list(enriched_urls):
+        if merger.shop_name(sanitize_filename(url)) not in pending_names:
+            journal.record(url, STAGE_SAVED)
+            enriched_urls.discard(url)
+    if image_failed_names:
+        print(
+            f"⚠️ {len(image_failed_names)}件のショップで画像の処理に失敗したため、"
+            "次回の保存で再度保存します。"
+        )
+    return True
 
-    df = pd.DataFrame(data_list)
-    merged_df = merge_dive_shop_info(df)
 
-    # course_description.jsonからコース詳細情報を適用
-    course_description_path = "backend/course_description.json"
-    merged_df = apply_course_description(merged_df, course_description_path)
+async def postprocess(
+    merger: ShopMerger,
+    journal: JobJournal,
+    enriched_urls: set,
+    output_dir: str,
+    db_client: AsyncClient,
+    http_client: httpx.AsyncClient,
+):
+    """
+    クロール中に保存されなかったショップをDBに保存し、全ショップの統合データを出力する。
+    """
+    merger.save()
+    if not merger.changed_names and not merger.delivered_names:
+        # 未保存の変更がないため、統合済みのURLの内容はすべてDBに反映済み
+        for url in enriched_urls:
+            journal.record(url, STAGE_SAVED)
+        print("\n⚠️ 新規・更新されたショップがありません。後続処理をスキップします。")
+        return
 
-    # DB保存
-    save_to_db(merged_df)
+    # --- 後続処理（コース詳細の付与、DB保存、統合データの出力）---
+    await save_changed_shops(merger, journal, enriched_urls, db_client, http_client)
 
-    # CSV出力
-    output_csv_path = os.path.join(output_dir, "merged_df.csv")
-    merged_df.to_csv(output_csv_path, index=False)
-    print(f"\n📄 CSVファイルを出力しました: {output_csv_path}")
+    # JSON Lines出力（全ショップ）。course_listなどのネストした列をJSONのまま保存する
+    output_dataset_path = os.path.join(output_dir, "merged_shops.jsonl")
+    with span("export_dataset", rows=len(merger)):
+        merged_df = apply_course_description(
+            pd.DataFrame(list(merger.records())), COURSE_DESCRIPTION_PATH
+        )
+        merged_df.to_json(
+            output_dataset_path, orient="records", lines=True, force_ascii=False
+        )
+    print(f"\n📄 統合データを出力しました: {output_dataset_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+import os
+import re
+from typing import Callable, List
+
+from diving_course_normalizer import find_course_mentions
+
+# ==== 設定 ====
+# 一致した行の前後に残す行数
+PRUNE_CONTEXT_LINES = int(os.getenv("PRUNE_CONTEXT_LINES", "2"))
+# 一致した行を含む見出しのセクションがこの行数以下なら、セクション全体を残す
+PRUNE_SECTION_MAX_LINES = int(os.getenv("PRUNE_SECTION_MAX_LINES", "80"))
+# 店舗情報の抽出で、ページ先頭から残す行数（店舗名・紹介文はページ先頭にあることが多い）
+PRUNE_SHOP_HEAD_LINES = int(os.getenv("PRUNE_SHOP_HEAD_LINES", "30"))
+# 店舗情報の抽出で残す画像の数
+PRUNE_SHOP_MAX_IMAGES = int(os.getenv("PRUNE_SHOP_MAX_IMAGES", "10"))
+
+# 金額（39,800円・¥39800・3.98万円 など）。
+# 「料金」などの語だけではナビゲーションのリンクにも一致するため、金額がある行だけを対象にする
+PRICE_PATTERN = re.compile(r"\d[\d,，.]*\s*(?:万\s*)?円|[¥￥]\s*\d")
+# 店舗の連絡先・所在地に関する行
+CONTACT_PATTERN = re.compile(
+    r"0\d{1,4}[-‐(（]\d{1,4}[-‐)）]\d{3,4}|[\w.+-]+@[\w-]+\.[\w.]+|〒\s*\d{3}-?\d{4}"
+    r"|TEL|Tel|電話|住所|所在地|アクセス|会社概要|店舗情報|営業時間|[都道府県](?:[^\s]{1,6}[市区町村郡])"
+)
+HEADING_PATTERN = re.compile(r"^\s{0,3}#{1,6}\s")
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+LINK_PATTERN = re.compile(r"(?<!!)\[([^\]]*)\]\([^)]*\)")
+
+
+def strip_links(line: str) -> str:
+    """
+    Markdownのリンクをリンクテキストだけにし、画像を取り除く。
+    """
+    return LINK_PATTERN.sub(r"\1", IMAGE_PATTERN.sub("", line))
+
+
+def _table_blocks(lines: List[str]) -> List[range]:
+    """
+    連続するテーブル行（"|"で始まる行）の範囲を返す。
+    """
+    blocks, start = [], None
+    for i, line in enumerate(lines + [""]):
+        if line.lstrip().startswith("|"):
+            start = i if start is None else start
+        elif start is not None:
+            blocks.append(range(start, i))
+            start = None
+    return blocks
+
+
+def _sections(lines: List[str]) -> List[range]:
+    """
+    見出しの行から次の見出しの直前までの範囲（セクション）を返す。
+    """
+    starts = [i for i, line in enumerate(lines) if HEADING_PATTERN.match(line)]
+    return [
+        range(start, end) for start, end in zip(starts, starts[1:] + [len(lines)])
+    ]
+
+
+def select_regions(
+    lines: List[str],
+    is_match: Callable[[str], bool],
+    context: int,
+    section_max_lines: int = 0,
+) -> List[int]:
+    """
+    条件に一致した行とその前後の行、直前の見出しの行番号を返す。
+    一致した行がテーブルの中にある場合は、見出し行を含めてテーブル全体を残す。
+    一致した行を含むセクションがsection_max_lines行以下なら、セクション全体を残す。
+
+    Returns:
+        List[int]: 残す行の番号（昇順）。一致する行がなければ空のリスト。
+    """
+    keep = set()
+    hits = [i for i, line in enumerate(lines) if is_match(line)]
+    if not hits:
+        return []
+    block_of = {}
+    for block in _table_blocks(lines):
+        for i in block:
+            block_of[i] = block
+    section_of = {}
+    for section in _sections(lines):
+        if len(section) <= section_max_lines:
+            for i in section:
+                section_of[i] = section
+    for i in hits:
+        if i in section_of:
+            keep.update(section_of[i])
+        if i in block_of:
+            keep.update(block_of[i])
+        keep.update(range(max(0, i - context), min(len(lines), i + context + 1)))
+        for j in range(i, -1, -1):
+            if HEADING_PATTERN.match(lines[j]):
+                keep.add(j)
+                break
+    return sorted(keep)
+
+
+def join_regions(lines: List[str], indices: List[int]) -> str:
+    """
+    残す行をつなげる。離れた領域の間には区切りとして空行を1つ入れる。
+    """
+    parts, previous = [], None
+    for i in indices:
+        if previous is not None and i != previous + 1:
+            parts.append("")
+        parts.append(lines[i])
+        previous = i
+    return "\n".join(parts)
+
+
+def prune_course_markdown(markdown: str, course_name_list) -> str:
+    """
+    コース情報の抽出用に、金額・コース名（語幹を含む）が現れる領域だけを残す。
+    一致した行を含む見出しのセクションは、料金のないコース一覧も含めて丸ごと残す。
+    リンクと画像は取り除く。一致する領域がない場合は元のMarkdownを返す。
+
+    Args:
+        markdown (str): ページのMarkdown。
+        course_name_list (list): 正規のコース/スペシャリティ名のリスト（別名も照合する）。
+
+    Returns:
+        str: LLMに渡すMarkdown。
+
+    Examples:
+        >>> names = ["オープン・ウォーター・ダイバー", "ナイト・ダイバー", "ドライスーツ・ダイバー"]
+        >>> page = "\\n".join(
+        ...     ["# ショップ", "[料金](/price) [アクセス](/access)"]
+        ...     + ["ブログ記事です。"] * 20
+        ...     + ["## スペシャルティ", "ナイトダイビング", "ドライスーツ", "お気軽にどうぞ。"]
+        ...     + ["## ライセンス", "| コース | 料金 |", "| --- | --- |",
+        ...        "| オープンウォーター講習 | 39,800円 |"]
+        ...     + ["## スタッフ"] + ["スタッフ紹介です。"] * 20
+        ... )
+        >>> print(prune_course_markdown(page, names))
+        ブログ記事です。
+        ## スペシャルティ
+        ナイトダイビング
+        ドライスーツ
+        お気軽にどうぞ。
+        ## ライセンス
+        | コース | 料金 |
+        | --- | --- |
+        | オープンウォーター講習 | 39,800円 |
+        ## スタッフ
+        スタッフ紹介です。
+    """
+    lines = [strip_links(line) for line in markdown.splitlines()]
+    lines = [line for line in lines if line.strip()]
+    indices = select_regions(
+        lines,
+        lambda line: bool(
+            PRICE_PATTERN.search(line) or find_course_mentions(line, course_name_list)
+        ),
+        PRUNE_CONTEXT_LINES,
+        PRUNE_SECTION_MAX_LINES,
+    )
+    if not indices:
+        return markdown
+    return join_regions(lines, indices)
+
+
+def prune_shop_markdown(markdown: str) -> str:
+    """
+    店舗情報の抽出用に、ページ先頭・連絡先や所在地が現れる領域・画像の一部だけを残す。
+    リンクはリンクテキストだけにし、画像は重複を除いて末尾にまとめる。
+
+    Args:
+        markdown (str): ページのMarkdown。
+
+    Returns:
+        str: LLMに渡すMarkdown。
+    """
+    images = IMAGE_PATTERN.findall(markdown)
+    text_lines = [strip_links(line) for line in markdown.splitlines()]
+    text_lines = [line for line in text_lines if line.strip()]
+
+    keep = set(range(min(PRUNE_SHOP_HEAD_LINES, len(text_lines))))
+    keep.update(
+        select_regions(
+            text_lines, lambda line: bool(CONTACT_PATTERN.search(line)), 1
+        )
+    )
+    pruned = join_regions(text_lines, sorted(keep))
+    unique_images = list(dict.fromkeys(images))[:PRUNE_SHOP_MAX_IMAGES]
+    if unique_images:
+        pruned += "\n\n" + "\n".join(unique_images)
+    return pruned
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from checkpoints import run_stage
+from crawl4ai import CrawlerRunConfig
+from crawl4ai.extraction_strategy import LLMExtractionStrategy
+from crawler_pool import CrawlerPool, run_crawl
+from instrumentation import annotate, span
+from llm_client import run_llm_extraction
+
+# ==== 設定 ====
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "backend/cache/page_cache.sqlite3")
+PAGE_CACHE_TTL_DAYS = float(os.getenv("PAGE_CACHE_TTL_DAYS", "30"))
+PAGE_CACHE_MAX_MB = float(os.getenv("PAGE_CACHE_MAX_MB", "200"))
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """
+    LLMによる抽出結果をSQLiteに保存するキャッシュ。
+
+    抽出結果は (URL, Markdownのハッシュ, 抽出設定のハッシュ) をキーに保存されるため、
+    ページ内容やプロンプトが変わらない限り、同じ抽出結果を再利用できる。
+    TTLを過ぎたエントリは削除され、合計サイズが上限を超えた場合は古い順に削除される。
+    """
+
+    def __init__(
+        self,
+        path: str = PAGE_CACHE_PATH,
+        ttl_days: float = PAGE_CACHE_TTL_DAYS,
+        max_mb: float = PAGE_CACHE_MAX_MB,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            -- 以前はページのMarkdownも保存していたが、読み出す処理がないため削除する
+            DROP TABLE IF EXISTS pages;
+            CREATE TABLE IF NOT EXISTS extractions (
+                url TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                extraction_key TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (url, content_hash, extraction_key)
+            );
+            """
+        )
+        self.evict()
+
+    def get_extraction(self, url: str, content_hash: str, extraction_key: str):
+        """
+        キャッシュ済みの抽出結果を返す。存在しない場合はNoneを返す。
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result FROM extractions"
+                " WHERE url = ? AND content_hash = ? AND extraction_key = ?",
+                (url, content_hash, extraction_key),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET accessed_at = ?"
+                " WHERE url = ? AND content_hash = ? AND extraction_key = ?",
+                (time.time(), url, content_hash, extraction_key),
+            )
+        return json.loads(row[0])
+
+    def put_extraction(
+        self, url: str, content_hash: str, extraction_key: str, result
+    ):
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    content_hash,
+                    extraction_key,
+                    payload,
+                    now,
+                    now,
+                    len(payload.encode()),
+                ),
+            )
+
+    def evict(self):
+        """
+        TTL切れのエントリを削除し、合計サイズが上限を超えていれば古いものから削除する。
+        """
+        expire_before = time.time() - self.ttl_seconds
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM extractions WHERE created_at < ?", (expire_before,)
+            )
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM extractions"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute(
+                "SELECT url, content_hash, extraction_key, size FROM extractions"
+                " ORDER BY accessed_at"
+            ).fetchall()
+            for url, content_hash, extraction_key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute(
+                    "DELETE FROM extractions WHERE url = ? AND content_hash = ?"
+                    " AND extraction_key = ?",
+                    (url, content_hash, extraction_key),
+                )
+                total -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_page_cache: Optional[PageCache] = None
+
+
+def get_page_cache() -> PageCache:
+    """
+    プロセス全体で共有するPageCacheを返す（初回呼び出し時に作成する）。
+    """
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache()
+    return _page_cache
+
+
+def get_extraction_key(strategy: LLMExtractionStrategy) -> str:
+    """
+    抽出結果に影響する設定（モデル・スキーマ・指示文）からキャッシュキーを作る。
+    """
+    key_source = json.dumps(
+        {
+            "provider": strategy.llm_config.provider,
+            "schema": strategy.schema,
+            "instruction": strategy.instruction,
+            "extraction_type": strategy.extraction_type,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hash_text(key_source)
+
+
+async def crawl_and_extract(
+    url: str,
+    config: CrawlerRunConfig,
+    strategy: LLMExtractionStrategy,
+    crawler_pool: CrawlerPool = None,
+    page_cache: PageCache = None,
+    checkpoint_key: str = None,
+    prune: Callable[[str], str] = None,
+) -> list:
+    """
+    ページを取得してMarkdownのハッシュを計算し、同じ内容の抽出結果がキャッシュにあれば
+    LLMを呼ばずにそれを返す。キャッシュがなければLLMで抽出し、結果を保存する。
+
+    Args:
+        url (str): 取得対象のURL。
+        config (CrawlerRunConfig): 抽出戦略を含まないクロール設定。
+        strategy (LLMExtractionStrategy): キャッシュミス時に使用する抽出戦略。
+        crawler_pool (CrawlerPool, optional): 共有ブラウザプール。
+        page_cache (PageCache, optional): 使用するキャッシュ。省略時は共有キャッシュ。
+        checkpoint_key (str, optional): 指定した場合、取得したMarkdownを中間結果として保存し、
+                                        再実行時はページを取得し直さずにそれを使う。
+        prune (Callable[[str], str], optional): LLMに渡す前にMarkdownを絞り込む関数。
+                                                抽出結果は絞り込み後の内容のハッシュで保存する。
+
+    Returns:
+        list: LLMExtractionStrategyの抽出結果（ブロックのリスト）。
+    """
+    page_cache = page_cache or get_page_cache()
+
+    async def fetch_markdown() -> str:
+        with span("crawl"):
+            result = await run_crawl(url, config, crawler_pool)
+            if not result.success:
+                raise RuntimeError(
+                    f"ページの取得に失敗しました: {url} ({result.error_message})"
+                )
+            annotate(bytes=len(result.markdown.raw_markdown.encode()))
+        return result.markdown.raw_markdown
+
+    markdown = await run_stage(checkpoint_key, f"markdown:{url}", fetch_markdown)
+    content_hash = hash_text(markdown)
+
+    # 絞り込み後の内容が同じなら、ページの他の部分が変わっても抽出結果を再利用できる
+    if prune is not None:
+        with span("prune_markdown", bytes=len(markdown.encode())):
+            markdown = prune(markdown)
+        content_hash = hash_text(markdown)
+
+    extraction_key = get_extraction_key(strategy)
+    with span("llm_extraction", bytes=len(markdown.encode())):
+        cached = page_cache.get_extraction(url, content_hash, extraction_key)
+        if cached is not None:
+            print(f"♻️ キャッシュ済みの抽出結果を再利用します: {url}")
+            annotate(cache_hits=1)
+            return cached
+
+        sections = config.chunking_strategy.chunk(markdown)
+        extracted = await asyncio.to_thread(
+            run_llm_extraction, strategy, url, sections
+        )
+    # LLM呼び出しが失敗したブロックを含む結果はキャッシュしない
+    if not any(isinstance(block, dict) and block.get("error") for block in extracted):
+        page_cache.put_extraction(url, content_hash, extraction_key, extracted)
+    return extracted
@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# ==== 設定 ====
+PLACES_CACHE_PATH = os.getenv("PLACES_CACHE_PATH", "backend/cache/places_cache.sqlite3")
+# 評価・口コミを再取得するまでの日数（Place IDは変わらないため期限なしで保存する）
+PLACES_DETAILS_TTL_DAYS = float(os.getenv("PLACES_DETAILS_TTL_DAYS", "7"))
+
+
+class PlacesCache:
+    """
+    Google Places APIの検索結果をSQLiteに保存するキャッシュ。
+
+    検索クエリからPlace IDへの対応は永続的に保存し、Place IDごとの評価・口コミは
+    TTL付きで保存する。TTLを過ぎたエントリも削除はせず、APIの上限に達した場合などの
+    代替として返せるよう残しておく。
+    """
+
+    def __init__(
+        self, path: str = PLACES_CACHE_PATH, ttl_days: float = PLACES_DETAILS_TTL_DAYS
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS place_ids (
+                query_key TEXT PRIMARY KEY,
+                place_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS details (
+                details_key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            """
+        )
+        self._import_legacy_json(f"{os.path.splitext(path)[0]}.json")
+
+    def _import_legacy_json(self, legacy_path: str):
+        """
+        以前のJSON形式のキャッシュがあれば取り込み、削除する（Place IDを再取得しないため）。
+        """
+        if legacy_path == self.path or not os.path.exists(legacy_path):
+            return
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO place_ids VALUES (?, ?)",
+                state.get("place_ids", {}).items(),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO details VALUES (?, ?, ?)",
+                (
+                    (key, json.dumps(entry["result"], ensure_ascii=False), entry["fetched_at"])
+                    for key, entry in state.get("details", {}).items()
+                ),
+            )
+        os.remove(legacy_path)
+
+    @staticmethod
+    def _query_key(query: str, language_code: str) -> str:
+        return f"{language_code}:{query.strip()}"
+
+    @staticmethod
+    def _details_key(place_id: str, language_code: str) -> str:
+        return f"{language_code}:{place_id}"
+
+    def get_place_id(self, query: str, language_code: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT place_id FROM place_ids WHERE query_key = ?",
+                (self._query_key(query, language_code),),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_place_id(self, query: str, language_code: str, place_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO place_ids VALUES (?, ?)",
+                (self._query_key(query, language_code), place_id),
+            )
+
+    def get_details(
+        self, place_id: str, language_code: str, allow_stale: bool = False
+    ) -> Optional[dict]:
+        """
+        キャッシュ済みの評価・口コミを返す。TTLを過ぎている場合は、allow_staleがTrueのときだけ返す。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, fetched_at FROM details WHERE details_key = ?",
+                (self._details_key(place_id, language_code),),
+            ).fetchone()
+        if row is None:
+            return None
+        result, fetched_at = row
+        if not allow_stale and time.time() - fetched_at >= self.ttl_seconds:
+            return None
+        return json.loads(result)
+
+    def set_details(self, place_id: str, language_code: str, result: dict):
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO details VALUES (?, ?, ?)",
+                (self._details_key(place_id, language_code), payload, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_places_cache: Optional[PlacesCache] = None
+_places_cache_lock = threading.Lock()
+
+
+def get_places_cache() -> PlacesCache:
+    """
+    プロセス全体で共有するPlacesCacheを返す（初回呼び出し時に作成する）。
+    get_place_detailsはスレッドから並行して呼ばれるため、作成はロックの中で1回だけ行う。
+    """
+    global _places_cache
+    if _places_cache is None:
+        with _places_cache_lock:
+            if _places_cache is None:
+                _places_cache = PlacesCache()
+    return _places_cache
@@ -1,27 +1,43 @@
 # -*- coding: utf-8 -*-
 """
-merged_df.csvのコース情報に、course_description.jsonから詳細情報を追加するスクリプト。
+merged_shops.jsonl（JSON Lines）のコース情報に、course_description.jsonから詳細情報を追加するスクリプト。
 プロジェクトのルートディレクトリから `python -m backend.scripts.apply_course_description` として実行してください。
 """
-import ast
 import json
 import os
+from typing import Optional
 
 import pandas as pd
 
 
-def apply_course_description(
-    df: pd.DataFrame, course_description_path: str
-) -> pd.DataFrame:
+# course_description.jsonから付与するコース詳細のカラム
+COURSE_DETAIL_COLUMNS = ["min_days", "full_description"]
+
+
+def explode_courses(df: pd.DataFrame) -> pd.DataFrame:
     """
-    DataFrameのcourse_list列に、コースの最低日数と詳細説明を追加する。
+    course_list列を展開し、1行1コースのフラットなコース表を作る。
 
     Args:
-        df (pd.DataFrame): 'course_list'列を含むDataFrame。
-        course_description_path (str): コース情報が記載されたJSONファイルのパス。
+        df (pd.DataFrame): 'name'列と'course_list'列を含むショップのDataFrame。
 
     Returns:
-        pd.DataFrame: 'min_days'と'full_description'が追加されたDataFrame。
+        pd.DataFrame: コースの各項目と、所属ショップ名の'shop_name'列を持つDataFrame。
+    """
+    exploded = df[["name", "course_list"]].explode("course_list", ignore_index=True)
+    exploded = exploded[exploded["course_list"].map(lambda c: isinstance(c, dict))]
+    # 欠損のある整数の列が浮動小数点数に変換されないよう、値はPythonのオブジェクトのまま保持する
+    courses = pd.DataFrame(exploded["course_list"].tolist(), dtype=object)
+    if "name" not in courses.columns:
+        courses["name"] = None
+    courses.insert(0, "shop_name", exploded["name"].to_numpy())
+    return courses
+
+
+def load_course_descriptions(course_description_path: str) -> Optional[pd.DataFrame]:
+    """
+    course_description.jsonを、コース名をキーとする'name'・'min_days'・'full_description'の表として読み込む。
+    ファイルがない場合や形式が正しくない場合はNoneを返す。
     """
     try:
         with open(course_description_path, "r", encoding="utf-8") as f:
@@ -30,68 +46,92 @@ def apply_course_description(
         print(
             f"⚠️  警告: {course_description_path} が見つかりませんでした。処理をスキップします。"
         )
-        return df
+        return None
     except json.JSONDecodeError:
         print(f"❌ エラー: {course_description_path} のJSON形式が正しくありません。")
-        return df
+        return None
+
+    descriptions = pd.DataFrame.from_dict(course_descriptions, orient="index")
+    descriptions = descriptions.reindex(columns=["min_days", "description"])
+    descriptions = descriptions.rename(columns={"description": "full_description"})
+    descriptions["min_days"] = descriptions["min_days"].astype("Int64")
+    return descriptions.rename_axis("name").reset_index()
+
+
+def build_course_table(
+    df: pd.DataFrame, course_description_path: str
+) -> pd.DataFrame:
+    """
+    course_listを展開したコース表に、コース名をキーとした1回の結合で最低日数と詳細説明を付与する。
+    course_description.jsonが読み込めない場合は、展開しただけのコース表を返す。
+    """
+    courses = explode_courses(df)
+    descriptions = load_course_descriptions(course_description_path)
+    if descriptions is not None:
+        courses = courses.drop(columns=COURSE_DETAIL_COLUMNS, errors="ignore")
+        courses = courses.merge(descriptions, on="name", how="left")
+    # 欠損値はNaN・pd.NAではなくNoneに揃える（整数の列はobject型のため、intのまま残る）
+    return courses.astype(object).where(courses.notna(), None)
+
 
-    def _add_details_to_row(courses):
-        if not isinstance(courses, list):
-            return courses
-        updated_courses = []
-        for course in courses:
-            if not isinstance(course, dict):
-                updated_courses.append(course)
-                continue
-
-            updated_course = course.copy()
-            course_name = updated_course.get("name")
-            description_data = (
-                course_descriptions.get(course_name) if course_name else None
-            )
-            updated_course["min_days"] = (
-                description_data.get("min_days") if description_data else None
-            )
-            updated_course["full_description"] = (
-                description_data.get("description") if description_data else None
-            )
-            updated_courses.append(updated_course)
-        return updated_courses
+def nest_courses(df: pd.DataFrame, courses: pd.DataFrame) -> pd.DataFrame:
+    """
+    フラットなコース表を、ショップごとのcourse_list列に戻す。
+    """
+    course_lists = {
+        shop_name: group.drop(columns="shop_name").to_dict("records")
+        for shop_name, group in courses.groupby("shop_name", sort=False)
+    }
+    df = df.copy()
+    df["course_list"] = [course_lists.get(name, []) for name in df["name"]]
+    return df
+
+
+def apply_course_description(
+    df: pd.DataFrame, course_description_path: str
+) -> pd.DataFrame:
+    """
+    DataFrameのcourse_list列に、コースの最低日数と詳細説明を追加する。
 
+    Args:
+        df (pd.DataFrame): 'course_list'列を含むDataFrame。
+        course_description_path (str): コース情報が記載されたJSONファイルのパス。
+
+    Returns:
+        pd.DataFrame: 'min_days'と'full_description'が追加されたDataFrame。
+    """
     if "course_list" not in df.columns:
         print("❌ エラー: DataFrameに 'course_list' 列が見つかりません。")
         return df
+    if not os.path.exists(course_description_path):
+        print(
+            f"⚠️  警告: {course_description_path} が見つかりませんでした。処理をスキップします。"
+        )
+        return df
 
-    df["course_list"] = df["course_list"].apply(_add_details_to_row)
+    df = nest_courses(df, build_course_table(df, course_description_path))
     print("✅ コース情報に最低日数と詳細説明を追加しました。")
     return df
 
 
 def main():
-    csv_path = "output/merged_df.csv"
+    dataset_path = "output/merged_shops.jsonl"
     course_description_path = "backend/course_description.json"
 
-    if not os.path.exists(csv_path):
-        print(f"❌ エラー: {csv_path} が見つかりません。")
+    if not os.path.exists(dataset_path):
+        print(f"❌ エラー: {dataset_path} が見つかりません。")
         return
 
-    print(f"📄 {csv_path} を読み込んでいます...")
-    converters = {
-        "course_list": lambda x: (
-            ast.literal_eval(x)
-            if isinstance(x, str) and x.strip().startswith("[")
-            else []
-        ),
-        "site_images": lambda x: (
-            ast.literal_eval(x)
-            if isinstance(x, str) and x.strip().startswith("[")
-            else []
-        ),
-    }
-    df = pd.read_csv(csv_path, converters=converters)
+    print(f"📄 {dataset_path} を読み込んでいます...")
+    # リスト・オブジェクトの列はJSONのまま復元される（型の推測は行わない）
+    df = pd.read_json(
+        dataset_path, lines=True, orient="records", dtype=False, convert_dates=False
+    )
     df_with_details = apply_course_description(df, course_description_path)
-    df_with_details.to_csv(csv_path, index=False)
-    print(f"💾 {csv_path} を更新しました。")
+    df_with_details.to_json(
+        dataset_path, orient="records", lines=True, force_ascii=False
+    )
+    print(f"💾 {dataset_path} を更新しました。")
 
 
 if __name__ == "__main__":
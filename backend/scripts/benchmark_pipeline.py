@@ -0,0 +1,659 @@
+# -*- coding: utf-8 -*-
+"""
+パイプライン全体をネットワーク・APIなしで計測するオフラインベンチマーク。
+
+shop_urls.jsonのショップを指定件数まで複製し、記録済みのショップページ
+（記録がなければbenchmark_fixtures/samplesのサンプルページ）を再生する。
+LLM・Google Placesは応答を固定した代替実装に、SupabaseはPostgREST・Storageを模した
+インメモリの代替（クライアントのtransportとして渡す）に差し替えて、
+main.pyと同じ経路（process_url → ShopMerger → postprocess）の
+スループット（ショップ/分）・ステージごとの処理時間（p50/p95）とバイト数・ピークRSSを計測する。
+postprocessの内訳（コース表の作成・save_to_db・統合データの出力）はステージごとの表に表示される。
+規模ごとに別プロセスで実行するため、ピークRSSは規模ごとの値になる。
+
+プロジェクトのルートディレクトリから `python -m backend.scripts.benchmark_pipeline` として実行してください。
+
+    # 80・1,000・10,000ショップで計測し、結果をJSONにも保存する
+    python -m backend.scripts.benchmark_pipeline --scales 80,1000,10000 --output output/benchmark.json
+
+    # 外部サービスの応答時間を模擬する（ミリ秒）。1規模あたりの制限時間は分で指定する
+    python -m backend.scripts.benchmark_pipeline --crawl-latency-ms 300 --llm-latency-ms 800 --timeout-minutes 120
+
+    # 実際のページを取得してフィクスチャとして記録する（crawl4aiとネットワークが必要）
+    python -m backend.scripts.benchmark_pipeline --record
+
+pytestからは小さな規模で実行し、すべてのショップがDBまで保存されることを確認する
+（backendディレクトリで `pytest`。規模はBENCHMARK_TEST_SHOPSで変更できる）。
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from queue import Empty
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHOP_URLS_PATH = os.path.join(BACKEND_DIR, "shop_urls.json")
+DIVE_INFO_PATH = os.path.join(BACKEND_DIR, "dive_info.json")
+COURSE_ALIAS_PATH = os.path.join(BACKEND_DIR, "course_aliases.json")
+# 記録したページのMarkdownを置くディレクトリ（URLごとに1ファイル）
+FIXTURE_DIR = os.getenv(
+    "BENCHMARK_FIXTURE_DIR", os.path.join(BACKEND_DIR, "benchmark_fixtures")
+)
+# 記録がないURLに返すサンプルページ（ショップのページの典型的な構成を模したもの）
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "benchmark_fixtures", "samples")
+DEFAULT_SCALES = (80, 1000, 10000)
+# 子プロセスの結果を待つ間、生存を確認する間隔（秒）
+RESULT_POLL_SECONDS = 5
+
+
+def fixture_path(url: str) -> str:
+    return os.path.join(FIXTURE_DIR, hashlib.sha256(url.encode()).hexdigest()[:16] + ".md")
+
+
+def load_shop_entries() -> list:
+    with open(SHOP_URLS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_entries(count: int) -> list:
+    """
+    shop_urls.jsonのエントリを繰り返し、ホスト名を変えて指定件数の架空のショップを作る。
+    各エントリは、ページの再生に使う元のURLを"source_url"に持つ。
+    """
+    entries = load_shop_entries()
+    result = []
+    for i in range(count):
+        base = entries[i % len(entries)]
+        parsed = urlparse(base["url"])
+        if i < len(entries):
+            url = base["url"]
+        else:
+            url = parsed._replace(netloc=f"bench-{i}.{parsed.netloc}").geturl()
+        result.append({**base, "url": url, "source_url": base["url"], "index": i})
+    return result
+
+
+def _stable_random(key: str) -> random.Random:
+    return random.Random(int(hashlib.sha256(key.encode()).hexdigest()[:16], 16))
+
+
+# ==== 代替実装 ====
+class FakePage:
+    """
+    URLごとに記録済みのMarkdownを返す。記録がないURLには、同梱のサンプルページ
+    （SAMPLE_DIR）からURLごとに決まった1つを返す。
+    """
+
+    def __init__(self, source_urls: dict):
+        self.source_urls = source_urls
+        self.samples = []
+        for name in sorted(os.listdir(SAMPLE_DIR)):
+            with open(os.path.join(SAMPLE_DIR, name), "r", encoding="utf-8") as f:
+                self.samples.append(f.read())
+
+    def markdown(self, url: str) -> str:
+        source_url = self.source_urls.get(url.rstrip("/"), url)
+        path = fixture_path(source_url)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        return _stable_random(source_url).choice(self.samples)
+
+
+class FakeCrawlerPool:
+    """
+    CrawlerPoolの代替。ブラウザを起動せず、FakePageのMarkdownを返す。
+    """
+
+    def __init__(self, pages: FakePage, latency: float):
+        self.pages = pages
+        self.latency = latency
+
+    async def arun(self, url: str, config):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(
+            success=True,
+            error_message=None,
+            markdown=SimpleNamespace(raw_markdown=self.pages.markdown(url)),
+        )
+
+
+def _chat_response(content: str, prompt_tokens: int, completion_tokens: int):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        ),
+    )
+
+
+def _canned_courses(key: str, course_names: list) -> list:
+    rng = _stable_random(key)
+    return [
+        {"name": name, "price": rng.randint(20, 90) * 1000, "level": "beginner"}
+        for name in rng.sample(course_names, k=min(4, len(course_names)))
+    ]
+
+
+def make_fake_llm(course_names: list, latency: float):
+    """
+    LLM呼び出し（crawl4aiの抽出・chat.completions）の代替を作る。
+    """
+    from instrumentation import annotate
+    from llm_client import budget, estimate_tokens
+
+    def fake_run_llm_extraction(strategy, url, sections):
+        if latency:
+            time.sleep(latency)
+        prompt_tokens = estimate_tokens("".join(sections)) + estimate_tokens(
+            strategy.instruction or ""
+        )
+        if "course_list" in json.dumps(strategy.schema):
+            blocks = [{"course_list": _canned_courses(url, course_names)}]
+        else:
+            host = urlparse(url).netloc or url
+            blocks = [
+                {
+                    "name": f"ダイビングショップ {host}",
+                    "description": "海の魅力をお伝えするダイビングショップです。",
+                    "prefecture": "沖縄県",
+                    "city": "那覇市",
+                    "image_url": f"https://{host}/images/top.png",
+                    "site_images": [f"https://{host}/images/{i}.png" for i in range(2)],
+                }
+            ]
+        budget.record(strategy.llm_config.provider, prompt_tokens, 200)
+        annotate(tokens=prompt_tokens + 200)
+        return blocks
+
+    def fake_create_chat_completion(llm_client=None, **kwargs):
+        if latency:
+            time.sleep(latency)
+        prompt = "".join(
+            str(message.get("content", "")) for message in kwargs.get("messages", [])
+        )
+        response_format = (kwargs.get("response_format") or {}).get("type")
+        if response_format == "json_schema":
+            content = json.dumps({"corrections": []})
+        elif response_format == "json_object":
+            content = json.dumps(
+                {"course_list": _canned_courses(prompt, course_names)},
+                ensure_ascii=False,
+            )
+        else:
+            content = "検索結果: " + "、".join(course_names[:5])
+        response = _chat_response(content, estimate_tokens(prompt), 150)
+        budget.record(kwargs.get("model", ""), estimate_tokens(prompt), 150)
+        annotate(tokens=estimate_tokens(prompt) + 150)
+        return response
+
+    return fake_run_llm_extraction, fake_create_chat_completion
+
+
+class FakeGmaps:
+    """
+    googlemaps.Clientの代替。クエリから決まるPlace IDと固定の口コミを返す。
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def find_place(self, input, input_type, fields, language):
+        if self.latency:
+            time.sleep(self.latency)
+        place_id = "place-" + hashlib.sha256(input.encode()).hexdigest()[:12]
+        return {"status": "OK", "candidates": [{"place_id": place_id, "name": input}]}
+
+    def place(self, place_id, fields, language):
+        if self.latency:
+            time.sleep(self.latency)
+        reviews = [
+            {"author_name": f"user{i}", "rating": 5, "text": "楽しいダイビングでした。"}
+            for i in range(5)
+        ]
+        return {
+            "status": "OK",
+            "result": {"rating": 4.6, "user_ratings_total": 120, "reviews": reviews},
+        }
+
+
+class LocalSupabase:
+    """
+    SupabaseのREST API（PostgREST）とStorageのうち、このリポジトリで使う操作だけを
+    メモリ上で実装した代替。httpx.MockTransportのハンドラとして、
+    create_async_clientのtransportに渡して使う（実際のクライアントがそのまま動く）。
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.storage_paths = set()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.startswith("/storage/v1/object/"):
+            return self._upload(path[len("/storage/v1/object/"):])
+        if path.startswith("/rest/v1/"):
+            return self._table(path[len("/rest/v1/"):], request)
+        return httpx.Response(404, json={"message": f"unknown path: {path}"})
+
+    def _upload(self, key: str) -> httpx.Response:
+        if key in self.storage_paths:
+            return httpx.Response(
+                400,
+                json={
+                    "statusCode": "409",
+                    "error": "Duplicate",
+                    "message": "The resource already exists",
+                },
+            )
+        self.storage_paths.add(key)
+        return httpx.Response(200, json={"Key": key, "Id": str(uuid.uuid4())})
+
+    @staticmethod
+    def _condition(column: str, expression: str):
+        operator, _, operand = expression.partition(".")
+        if operator == "in":
+            # カンマなどを含む値は、PostgRESTの書式に従ってダブルクォートで囲まれている
+            values = set(next(csv.reader([operand[1:-1]])))
+            return lambda row: str(row.get(column)) in values
+        if operator == "eq":
+            return lambda row: str(row.get(column)) == operand
+        if operator == "gt":
+            return lambda row: row.get(column) is not None and str(row[column]) > operand
+        raise ValueError(f"未対応のフィルタです: {column}={expression}")
+
+    def _table(self, table_name: str, request: httpx.Request) -> httpx.Response:
+        rows = self.tables.setdefault(table_name, [])
+        params = request.url.params
+        conditions = [
+            self._condition(column, expression)
+            for column, expression in params.multi_items()
+            if column not in ("select", "order", "limit", "on_conflict", "columns")
+        ]
+
+        def matches(row) -> bool:
+            return all(condition(row) for condition in conditions)
+
+        if request.method == "GET":
+            data = [row for row in rows if matches(row)]
+            if "order" in params:
+                column = params["order"].split(".")[0]
+                data.sort(key=lambda row: str(row.get(column)))
+            if "limit" in params:
+                data = data[: int(params["limit"])]
+            return httpx.Response(200, json=data)
+
+        if request.method == "DELETE":
+            data = [row for row in rows if matches(row)]
+            rows[:] = [row for row in rows if not matches(row)]
+            return httpx.Response(200, json=data)
+
+        payload = json.loads(request.content)
+        payload = payload if isinstance(payload, list) else [payload]
+        if "on_conflict" not in params:
+            data = [{"id": str(uuid.uuid4()), **row} for row in payload]
+            rows.extend(data)
+            return httpx.Response(201, json=data)
+        keys = params["on_conflict"].split(",")
+        index = {tuple(row.get(key) for key in keys): row for row in rows}
+        data = []
+        for row in payload:
+            existing = index.get(tuple(row.get(key) for key in keys))
+            if existing is None:
+                existing = {"id": str(uuid.uuid4())}
+                rows.append(existing)
+                index[tuple(row.get(key) for key in keys)] = existing
+            existing.update(row)
+            data.append(dict(existing))
+        return httpx.Response(201, json=data)
+
+
+def _sample_png() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (0, 90, 160)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# ==== 計測 ====
+def _peak_rss_mb() -> float:
+    # Linuxではキロバイト、macOSではバイト単位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _timed(results: dict, name: str, count: int, func):
+    started_at = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - started_at
+    results[name] = {
+        "seconds": elapsed,
+        "items": count,
+        "items_per_minute": count / elapsed * 60 if elapsed else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    return value
+
+
+def run_scale(count: int, options: dict, patch=setattr) -> dict:
+    """
+    1つの規模で全ベンチマークを実行する（ピークRSSを分けるため、規模ごとに別プロセスで呼ばれる）。
+
+    Args:
+        count (int): 合成するショップ数。
+        options (dict): 外部サービスの応答時間（crawl_latency_ms・llm_latency_ms・places_latency_ms）。
+        patch (callable, optional): モジュールの属性を代替実装に差し替える関数（setattrと同じ引数）。
+                                    pytestからは、終了後に元に戻せるmocker.patch.objectを渡す。
+    """
+    work_dir = tempfile.mkdtemp(prefix=f"dive_benchmark_{count}_")
+    # キャッシュ類はすべて一時ディレクトリに作り、実データを汚さない
+    os.environ.update(
+        {
+            "PAGE_CACHE_PATH": os.path.join(work_dir, "page_cache.sqlite3"),
+            "CHECKPOINT_PATH": os.path.join(work_dir, "checkpoints.sqlite3"),
+            "PLACES_CACHE_PATH": os.path.join(work_dir, "places_cache.sqlite3"),
+            "COURSE_ALIAS_PATH": os.path.join(work_dir, "course_aliases.json"),
+            "JOB_JOURNAL_PATH": os.path.join(work_dir, "job_journal.sqlite3"),
+            "OPENAI_MAX_RPM": "1000000000",
+            "OPENAI_MAX_TPM": "1000000000000",
+        }
+    )
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("GOOGLE_API_KEY", "AIzaBenchmarkKeyBenchmarkKeyBenchmark0")
+    # Supabaseへのリクエストはすべてtransportで処理されるため、URLとキーは形式だけ満たせばよい
+    os.environ.setdefault("SUPABASE_API_URL", "http://supabase.benchmark.invalid")
+    os.environ.setdefault("SUPABASE_API_KEY", "benchmark-key")
+    if os.path.exists(COURSE_ALIAS_PATH):
+        with open(COURSE_ALIAS_PATH, "rb") as src, open(
+            os.environ["COURSE_ALIAS_PATH"], "wb"
+        ) as dst:
+            dst.write(src.read())
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    import diving_course_normalizer
+    import get_place_details
+    import main as pipeline
+    import page_cache
+    from database import supabase_client
+    from instrumentation import recorder
+    from job_journal import JOB_JOURNAL_PATH, JobJournal
+    from shop_merger import ShopMerger
+
+    with open(DIVE_INFO_PATH, "r", encoding="utf-8") as f:
+        dive_info = json.load(f)
+    license_list, specialty_list = dive_info["license"], dive_info["specialities"]
+    course_names = license_list + specialty_list
+
+    entries = synthetic_entries(count)
+    source_urls = {}
+    for entry in entries:
+        source_urls[entry["url"].rstrip("/")] = entry["source_url"]
+        hostname = re.match(pipeline.pattern, entry["url"]).group(0)
+        source_urls[hostname] = re.match(pipeline.pattern, entry["source_url"]).group(0)
+
+    latency = options["llm_latency_ms"] / 1000
+    fake_extraction, fake_chat = make_fake_llm(course_names, latency)
+    patch(page_cache, "run_llm_extraction", fake_extraction)
+    patch(pipeline, "create_chat_completion", fake_chat)
+    patch(diving_course_normalizer, "create_chat_completion", fake_chat)
+    patch(get_place_details, "gmaps", FakeGmaps(options["places_latency_ms"] / 1000))
+    local_supabase = LocalSupabase()
+
+    png = _sample_png()
+    image_transport = httpx.MockTransport(
+        lambda request: httpx.Response(
+            200, content=png, headers={"Content-Type": "image/png"}
+        )
+    )
+
+    crawler_pool = FakeCrawlerPool(
+        FakePage(source_urls), options["crawl_latency_ms"] / 1000
+    )
+    output_dir = os.path.join(work_dir, "output")
+    results = {"shops": count, "benchmarks": {}}
+    benchmarks = results["benchmarks"]
+
+    async def run_process_url():
+        semaphore = asyncio.Semaphore(pipeline.MAX_CONCURRENT_SHOPS)
+
+        async def run_one(entry):
+            async with semaphore:
+                with pipeline.shop_context(entry["url"]), pipeline.span("process_url"):
+                    return await pipeline.process_url(
+                        entry["url"], license_list, specialty_list, output_dir, crawler_pool
+                    )
+
+        return await asyncio.gather(*(run_one(entry) for entry in entries))
+
+    async def run_postprocess(enriched_urls: set):
+        # Supabaseと画像のダウンロードは、どちらもtransportを差し替えたクライアントで行う
+        async with (
+            supabase_client.create_async_client(
+                transport=local_supabase.transport()
+            ) as db_client,
+            httpx.AsyncClient(transport=image_transport) as http_client,
+        ):
+            await pipeline.postprocess(
+                merger, journal, enriched_urls, output_dir, db_client, http_client
+            )
+
+    # save_resultの完了ログは件数が多いと計測を妨げるため、標準出力を捨てる
+    with open(os.devnull, "w") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            shop_infos = _timed(
+                benchmarks, "process_url", count, lambda: asyncio.run(run_process_url())
+            )
+            extracted = [
+                (entry["url"], info) for entry, info in zip(entries, shop_infos) if info
+            ]
+            merger = ShopMerger(os.path.join(output_dir, "merged_shops_state.json"))
+            _timed(
+                benchmarks,
+                "shop_merger",
+                len(extracted),
+                lambda: [
+                    merger.add(pipeline.sanitize_filename(url), info)
+                    for url, info in extracted
+                ],
+            )
+            changed_count = len(merger.changed_names)
+            journal = JobJournal(JOB_JOURNAL_PATH)
+            try:
+                _timed(
+                    benchmarks,
+                    "postprocess",
+                    changed_count,
+                    lambda: asyncio.run(run_postprocess({url for url, _ in extracted})),
+                )
+            finally:
+                journal.close()
+        finally:
+            sys.stdout = stdout
+
+    # save_to_dbは失敗しても例外を送出しないため、すべてのショップが保存されたことを確認する
+    saved_shops = len(local_supabase.tables.get("diving_shops", []))
+    if merger.changed_names or saved_shops != changed_count:
+        raise RuntimeError(
+            f"DBへの保存が完了していません（保存 {saved_shops}件 / 変更 {changed_count}件）"
+        )
+
+    results["stages"] = recorder.summary()["stages"]
+    results["peak_rss_mb"] = _peak_rss_mb()
+    results["db_rows"] = {name: len(rows) for name, rows in local_supabase.tables.items()}
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _run_scale_in_child(count: int, options: dict, queue):
+    try:
+        queue.put(run_scale(count, options))
+    except Exception as e:
+        queue.put({"shops": count, "error": f"{type(e).__name__}: {e}"})
+
+
+def _wait_for_result(process, queue, count: int, timeout: float) -> dict:
+    """
+    子プロセスの結果を待つ。子プロセスが結果を返さずに終了した場合（メモリ不足で
+    強制終了された場合など）や、制限時間を過ぎた場合はエラーの結果を返す。
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            pass
+        if not process.is_alive():
+            # 終了の直前に書き込まれた結果が、まだ届いていない場合がある
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return {
+                    "shops": count,
+                    "error": f"子プロセスが終了コード{process.exitcode}で終了しました",
+                }
+        if deadline is not None and time.monotonic() > deadline:
+            process.terminate()
+            return {"shops": count, "error": f"{timeout / 60:.0f}分以内に完了しませんでした"}
+
+
+def format_results(all_results: list) -> str:
+    lines = []
+    for result in all_results:
+        lines.append(f"\n===== {result['shops']:,} ショップ =====")
+        if "error" in result:
+            lines.append(f"❌ 失敗しました: {result['error']}")
+            continue
+        lines.append(
+            f"{'benchmark':<26}{'items':>8}{'seconds':>10}{'items/min':>12}{'peak RSS(MB)':>14}"
+        )
+        for name, stats in result["benchmarks"].items():
+            rate = stats["items_per_minute"]
+            lines.append(
+                f"{name:<26}{stats['items']:>8,}{stats['seconds']:>10.2f}"
+                f"{(f'{rate:,.0f}' if rate else '-'):>12}{stats['peak_rss_mb']:>14.1f}"
+            )
+        lines.append("")
+        lines.append(
+            f"{'stage':<32}{'count':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'MB':>10}"
+        )
+        for stage, stats in sorted(
+            result["stages"].items(), key=lambda item: item[1]["total"], reverse=True
+        ):
+            size = f"{stats['bytes'] / 1_000_000:.2f}" if "bytes" in stats else "-"
+            lines.append(
+                f"{stage:<32}{stats['count']:>8,}{stats['p50'] * 1000:>10.1f}"
+                f"{stats['p95'] * 1000:>10.1f}{size:>10}"
+            )
+        lines.append(f"DBの行数: {result['db_rows']}")
+    return "\n".join(lines)
+
+
+async def record_fixtures():
+    """
+    shop_urls.jsonの各ページとトップページを実際に取得し、Markdownをフィクスチャとして保存する。
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    from crawl4ai import CrawlerRunConfig
+    from crawler_pool import CrawlerPool
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    urls = []
+    for entry in load_shop_entries():
+        urls.append(entry["url"])
+        urls.append(re.match(r"^(https?://)([^/]+)", entry["url"]).group(0))
+    config = CrawlerRunConfig(exclude_external_links=True, word_count_threshold=20)
+    async with CrawlerPool(size=2) as crawler_pool:
+        for url in dict.fromkeys(urls):
+            result = await crawler_pool.arun(url, config)
+            if not result.success:
+                print(f"⚠️ 取得に失敗しました: {url} ({result.error_message})")
+                continue
+            with open(fixture_path(url), "w", encoding="utf-8") as f:
+                f.write(result.markdown.raw_markdown)
+            print(f"✅ 記録しました: {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプラインのオフラインベンチマーク")
+    parser.add_argument(
+        "--scales",
+        default=",".join(str(scale) for scale in DEFAULT_SCALES),
+        help="計測するショップ数（カンマ区切り）",
+    )
+    parser.add_argument("--crawl-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--places-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--timeout-minutes",
+        type=float,
+        default=120.0,
+        help="1規模あたりの制限時間（分）。0の場合は制限しない",
+    )
+    parser.add_argument("--output", help="結果を書き出すJSONファイルのパス")
+    parser.add_argument(
+        "--record", action="store_true", help="実際のページを取得してフィクスチャを記録する"
+    )
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record_fixtures())
+        return
+
+    options = {
+        "crawl_latency_ms": args.crawl_latency_ms,
+        "llm_latency_ms": args.llm_latency_ms,
+        "places_latency_ms": args.places_latency_ms,
+    }
+    context = multiprocessing.get_context("spawn")
+    all_results = []
+    for scale in (int(value) for value in args.scales.split(",")):
+        print(f"⏱️ {scale:,}ショップで計測しています...")
+        queue = context.Queue()
+        process = context.Process(
+            target=_run_scale_in_child, args=(scale, options, queue)
+        )
+        process.start()
+        all_results.append(
+            _wait_for_result(process, queue, scale, args.timeout_minutes * 60)
+        )
+        process.join()
+
+    print(format_results(all_results))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"options": options, "results": all_results},
+                f,
+                indent=4,
+                ensure_ascii=False,
+            )
+        print(f"\n📊 結果を出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
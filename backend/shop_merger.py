@@ -0,0 +1,197 @@
+import json
+import os
+from typing import Iterable, Iterator, List, Optional
+
+# ショップ情報のうち、統合時にURLごとに保持するコース情報のキー
+COURSE_LIST_KEY = "course_list"
+
+
+class ShopMerger:
+    """
+    URLごとのショップ抽出結果を、ショップ名をキーとして逐次統合するアキュムレータ。
+
+    同じショップ名の結果が複数のURLから得られた場合、店舗情報は最初に登録されたURLのものを使い、
+    コース情報はURLごとに保持したうえでコース名の重複を除いて結合する。
+    状態はJSONファイルに保存され、次回の実行では更新されたショップだけが後続処理に渡される。
+    """
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._shops = state["shops"]
+            # 前回の実行で後続処理に渡す前に中断されたショップも、更新ありとして引き継ぐ
+            self.changed_names = set(state.get("pending_names", []))
+            self._loaded_at = os.path.getmtime(state_path)
+        except FileNotFoundError:
+            self._shops = {}
+            self.changed_names = set()
+            self._loaded_at = 0.0
+        # 後続処理に渡したが、完了がまだ記録されていないショップ
+        self._delivering = set()
+        # この実行で後続処理が完了したショップ
+        self.delivered_names = set()
+        # ソース（URLごとの出力ファイル名）から、それが属するショップ名への索引
+        self._source_names = {
+            source: name
+            for name, entry in self._shops.items()
+            for source in entry["sources"]
+        }
+
+    def __len__(self) -> int:
+        return len(self._shops)
+
+    def add(self, source: str, shop_info: dict) -> bool:
+        """
+        1件の抽出結果を統合する。
+
+        Args:
+            source (str): 結果の取得元を表すキー（URLごとの出力ファイル名）。
+            shop_info (dict): course_listを含むショップ情報。
+
+        Returns:
+            bool: 統合後のショップ情報が変わった場合はTrue。
+        """
+        name = shop_info.get("name")
+        if not name:
+            return False
+        courses = shop_info.get(COURSE_LIST_KEY) or []
+        shop = {key: value for key, value in shop_info.items() if key != COURSE_LIST_KEY}
+
+        # 同じソースが以前は別のショップ名に属していた場合は、そちらから取り除く
+        previous_name = self._source_names.get(source)
+        if previous_name is not None and previous_name != name:
+            self._remove_source(previous_name, source)
+
+        entry = self._shops.get(name)
+        if entry is None:
+            entry = {"base_source": source, "shop": shop, "sources": {}}
+            self._shops[name] = entry
+            changed = True
+        else:
+            changed = False
+            if entry["base_source"] == source and entry["shop"] != shop:
+                entry["shop"] = shop
+                changed = True
+
+        if entry["sources"].get(source) != courses:
+            entry["sources"][source] = courses
+            changed = True
+        self._source_names[source] = name
+
+        if changed:
+            self.changed_names.add(name)
+        return changed
+
+    def _remove_source(self, name: str, source: str):
+        entry = self._shops.get(name)
+        if entry is None:
+            return
+        entry["sources"].pop(source, None)
+        if not entry["sources"]:
+            del self._shops[name]
+        elif entry["base_source"] == source:
+            entry["base_source"] = next(iter(entry["sources"]))
+        self.changed_names.add(name)
+
+    def merged_record(self, name: str) -> Optional[dict]:
+        """
+        ショップ名に対応する統合済みのショップ情報を返す（コース名はsetで重複排除する）。
+        """
+        entry = self._shops.get(name)
+        if entry is None:
+            return None
+        seen_names = set()
+        course_list = []
+        for courses in entry["sources"].values():
+            for course in courses:
+                course_name = course.get("name") if isinstance(course, dict) else None
+                if course_name in seen_names:
+                    continue
+                seen_names.add(course_name)
+                course_list.append(course)
+        return {**entry["shop"], COURSE_LIST_KEY: course_list}
+
+    def records(self, names: Iterable[str] = None) -> Iterator[dict]:
+        """
+        統合済みのショップ情報を1件ずつ返す。namesを指定した場合はそのショップだけを返す。
+        """
+        for name in self._shops if names is None else names:
+            record = self.merged_record(name)
+            if record is not None:
+                yield record
+
+    def add_from_output_dir(self, output_dir: str) -> int:
+        """
+        前回の状態保存より後に書き出された出力ファイルを取り込む。
+        状態ファイルがない場合は、すべての出力ファイルを1件ずつ読み込んで統合する。
+
+        Returns:
+            int: 取り込んだファイル数。
+        """
+        if not os.path.isdir(output_dir):
+            return 0
+        count = 0
+        state_path = os.path.abspath(self.state_path)
+        for entry in os.scandir(output_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            if os.path.abspath(entry.path) == state_path:
+                continue
+            if entry.stat().st_mtime <= self._loaded_at:
+                continue
+            with open(entry.path, "r", encoding="utf-8") as f:
+                self.add(entry.name, json.load(f))
+            count += 1
+        return count
+
+    def shop_name(self, source: str) -> Optional[str]:
+        """
+        ソース（URLごとの出力ファイル名）が属するショップ名を返す。
+        """
+        return self._source_names.get(source)
+
+    def pending_names(self) -> set:
+        """
+        後続処理が完了していないショップ名（処理中のものを含む）を返す。
+        """
+        return self.changed_names | self._delivering
+
+    def begin_delivery(self) -> List[str]:
+        """
+        更新されたショップを後続処理に渡す。
+
+        渡したショップはchanged_namesから外れるため、処理中に同じショップが再び更新された場合は
+        changed_namesに戻り、次の後続処理に渡される。end_deliveryで完了が記録されるまでは、
+        状態ファイルには未処理として保存される。
+
+        Returns:
+            List[str]: 後続処理に渡すショップ名のリスト。
+        """
+        names = sorted(self.changed_names)
+        self._delivering.update(names)
+        self.changed_names.clear()
+        return names
+
+    def end_delivery(self, names: Iterable[str], failed: Iterable[str] = ()):
+        """
+        begin_deliveryで渡したショップの後続処理が終わったことを記録する。
+        failedに指定したショップは未処理に戻し、次の後続処理に再度渡す。
+        """
+        names, failed = set(names), set(failed)
+        self._delivering -= names
+        self.changed_names |= names & failed
+        self.delivered_names |= names - failed
+
+    def save(self):
+        """
+        状態（未処理の更新ショップ名を含む）を一時ファイル経由で保存する。
+        """
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        state = {"shops": self._shops, "pending_names": sorted(self.pending_names())}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self._loaded_at = os.path.getmtime(self.state_path)
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+# パイプライン（main.py）はcrawl4aiをインポートするため、インストールされていない環境では実行しない
+pytest.importorskip("crawl4ai")
+
+from scripts.benchmark_pipeline import BACKEND_DIR, run_scale  # noqa: E402
+
+# 計測するショップ数
+BENCHMARK_TEST_SHOPS = int(os.getenv("BENCHMARK_TEST_SHOPS", "80"))
+# 指定した場合、パイプライン全体のスループット（ショップ/分）がこれを下回ると失敗にする
+BENCHMARK_MIN_SHOPS_PER_MINUTE = float(os.getenv("BENCHMARK_MIN_SHOPS_PER_MINUTE", "0"))
+
+
+def test_pipeline_benchmark(mocker, monkeypatch):
+    """
+    記録済みのページと固定の応答でパイプライン全体を実行し、すべてのショップがDBまで保存されることを確認する。
+    """
+    # main.pyはプロジェクトのルートディレクトリからの相対パスでファイルを読む
+    monkeypatch.chdir(os.path.dirname(BACKEND_DIR))
+    # run_scaleが設定するキャッシュのパスなどは、テストの終了後に元に戻す
+    mocker.patch.dict(os.environ)
+
+    results = run_scale(
+        BENCHMARK_TEST_SHOPS,
+        {"crawl_latency_ms": 0, "llm_latency_ms": 0, "places_latency_ms": 0},
+        patch=mocker.patch.object,
+    )
+
+    benchmarks = results["benchmarks"]
+    assert benchmarks["process_url"]["items"] == BENCHMARK_TEST_SHOPS
+    assert results["db_rows"]["diving_shops"] == benchmarks["postprocess"]["items"]
+    assert results["db_rows"]["diving_courses"] > 0
+    stages = results["stages"]
+    for stage in ("process_url", "build_course_table", "save_to_db", "export_dataset"):
+        assert stages[stage]["count"] > 0
+        assert stages[stage]["errors"] == 0
+
+    if BENCHMARK_MIN_SHOPS_PER_MINUTE:
+        seconds = sum(benchmark["seconds"] for benchmark in benchmarks.values())
+        shops_per_minute = BENCHMARK_TEST_SHOPS / seconds * 60
+        assert shops_per_minute >= BENCHMARK_MIN_SHOPS_PER_MINUTE